@@ -0,0 +1,211 @@
+"""
+Offline benchmark for the bot: no Telegram, Gemini or Supabase traffic.
+
+    python benchmark.py            # print timings
+    python benchmark.py --save     # store them as this machine's baseline
+    python benchmark.py --check    # fail if anything is slower than the baseline allows
+
+Timings depend on the machine, so the baseline is local (benchmark_baseline.json is not committed);
+--check on a machine without one saves the run as the baseline and passes.
+
+Full conversations run through the real ConversationHandler with the fakes in tests/fakes.py:
+a scripted chat model, an in-memory Supabase table store and a fake Bot API transport.
+The loop_lag_* entries show how late a 5ms ticker on the event loop fires while large outputs
+are post-processed inline vs through the post-processing pool. They are mostly scheduler noise
+at this size, so they are printed but not checked.
+"""
+import os
+
+# main.py and prompt_engine.py read these at import time; none of them is used for real traffic here
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("RUN_MODE", "polling")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_URL", "https://benchmark.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "benchmark.benchmark.benchmark")
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import timeit
+
+import main
+import postprocess
+import prompt_engine
+from tests.fakes import ScriptedChatModel, InMemorySupabase, BotHarness, EXPLANATION_JSON
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_TOLERANCE = 1.5  # allowed slowdown factor before --check fails
+UNCHECKED_PREFIXES = ("loop_lag_",)
+
+# ========== CONVERSATIONS ==========
+
+async def conversation_normal(driver):
+    await driver.send("/start")
+    await driver.send("how do vaccines work")
+    await driver.press("mode:clarity")
+    await driver.press("explain:yes")
+
+
+async def conversation_one_shot(driver):
+    await driver.send("/optimize concise explain black holes to a child")
+    await driver.press("explain:no")
+
+
+async def conversation_deep_research(driver):
+    await driver.send("/start")
+    await driver.send("history of the indian stock market")
+    await driver.press("mode:deep_research")
+    await driver.press("followup:yes")
+    await driver.send("What time period? Which exchanges?")
+    await driver.send("no")
+    await driver.press("explain:yes")
+
+
+CONVERSATIONS = {
+    "conversation_normal": (conversation_normal, True),
+    "conversation_explain_no_json": (conversation_normal, False),
+    "conversation_one_shot": (conversation_one_shot, True),
+    "conversation_deep_research": (conversation_deep_research, True),
+}
+
+# ========== TIMING ==========
+
+def time_sync(fn, repeat=7) -> float:
+    """Best seconds per call; each run loops long enough (>= 0.2s) for sub-µs calls to be measurable."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    # The fastest run is the one least disturbed by the rest of the machine
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+async def time_conversations(number=20) -> dict:
+    prompt_engine.supabase = InMemorySupabase()
+    results = {}
+    async with BotHarness() as harness:
+        for name, (conversation, explain_as_json) in CONVERSATIONS.items():
+            prompt_engine.model = ScriptedChatModel(explain_as_json=explain_as_json)
+            runs = []
+            for _ in range(number):
+                driver = harness.chat()
+                started = time.perf_counter()
+                await conversation(driver)
+                runs.append(time.perf_counter() - started)
+            results[name] = min(runs)
+    if harness.errors:
+        # A handler that raised finishes early and would look like a speed-up
+        raise RuntimeError(f"Handlers raised during the benchmark: {harness.errors!r}")
+    return results
+
+
+LARGE_OUTPUT = ("Research section with findings and sources. " * 50 + "\n\n") * 1000 + \
+    "```json\n" + json.dumps(EXPLANATION_JSON) + "\n```"
+LAG_TICK = 0.005
+
+
+async def measure_loop_lag(work) -> float:
+    """Worst delay of a periodic ticker while `work()` runs; a blocked loop shows up here."""
+    lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal lag
+        while not done.is_set():
+            expected = time.perf_counter() + LAG_TICK
+            await asyncio.sleep(LAG_TICK)
+            lag = max(lag, time.perf_counter() - expected)
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(LAG_TICK * 2)
+    try:
+        await work()
+    finally:
+        done.set()
+        await ticking
+    return lag
+
+
+async def time_loop_lag(number=5) -> dict:
+    async def inline():
+        for _ in range(number):
+            postprocess.parse_explanation(LARGE_OUTPUT)
+            postprocess.split_for_telegram(LARGE_OUTPUT)
+            await asyncio.sleep(0)
+
+    async def offloaded():
+        for _ in range(number):
+            await postprocess.run_postprocess(postprocess.parse_explanation, LARGE_OUTPUT, size=len(LARGE_OUTPUT))
+            await postprocess.run_postprocess(postprocess.split_for_telegram, LARGE_OUTPUT, size=len(LARGE_OUTPUT))
+
+    # Start every worker outside the measurement so worker startup is not counted as lag
+    await asyncio.gather(*(
+        postprocess.run_postprocess(time.sleep, 0.05, size=postprocess.POSTPROCESS_INLINE_CHARS)
+        for _ in range(postprocess.POSTPROCESS_WORKERS)
+    ))
+    try:
+        return {
+            "loop_lag_inline_max": await measure_loop_lag(inline),
+            "loop_lag_offloaded_max": await measure_loop_lag(offloaded),
+        }
+    finally:
+        postprocess.shutdown_postprocess()
+
+
+def run_benchmarks() -> dict:
+    short_text = "x" * 1000
+    medium_text = "x" * 15000
+    long_text = "x" * 60000
+    fenced_json = "Here you go:\n```json\n" + json.dumps(EXPLANATION_JSON) + "\n```"
+
+    results = {
+        "get_send_strategy_text": time_sync(lambda: main.get_send_strategy(short_text)),
+        "get_send_strategy_chunks": time_sync(lambda: main.get_send_strategy(medium_text)),
+        "get_send_strategy_file": time_sync(lambda: main.get_send_strategy(long_text)),
+        "format_explanation_to_messages": time_sync(
+            lambda: postprocess.format_explanation_to_messages(EXPLANATION_JSON)
+        ),
+        "extract_json_from_response": time_sync(
+            lambda: postprocess.extract_json_from_response(fenced_json)
+        ),
+    }
+    results.update(asyncio.run(time_conversations()))
+    results.update(asyncio.run(time_loop_lag()))
+    return results
+
+
+def check_against_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, seconds in results.items():
+        if name.startswith(UNCHECKED_PREFIXES):
+            continue
+        reference = baseline.get(name)
+        if reference and seconds > reference * tolerance:
+            regressions.append(f"{name}: {seconds * 1e6:.1f}µs vs baseline {reference * 1e6:.1f}µs")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline bot benchmarks")
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+    for name, seconds in results.items():
+        print(f"{name:<36} {seconds * 1e6:>12.1f} µs")
+
+    if args.save or (args.check and not os.path.exists(BASELINE_FILE)):
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline saved to {BASELINE_FILE}")
+
+    if args.check:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+        regressions = check_against_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("✅ No regressions.")
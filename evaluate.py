@@ -0,0 +1,279 @@
+"""
+Offline A/B evaluation of optimize_prompt variants.
+
+    python evaluate.py variants.json [--corpus corpus.json] [--llm-judge]
+
+variants.json lists the configurations to compare; anything left out uses the live setup:
+
+    {"variants": [
+        {"name": "baseline"},
+        {"name": "flash-lite", "model": "gemini-2.5-flash-lite",
+         "price_per_million": {"input": 0.10, "output": 0.40}},
+        {"name": "clarity-v2", "modes": {"clarity": "Rewrite the prompt so that ..."}}
+    ]}
+
+corpus.json is a list of {"prompt": ..., "mode": ...}; a small built-in corpus is used otherwise.
+Outputs are always scored with cheap heuristics; --llm-judge also has explain_prompt rate each one
+1-10 against the variant's own goal for the mode.
+
+Generations and judgements are cached on disk, keyed on the model, the exact system prompt and
+the user prompt, so re-running after changing one variant only regenerates that variant.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+
+from langchain.chat_models import init_chat_model
+
+from prompt_engine import (
+    optimize_prompt, explain_prompt, build_system_prompt, system_prompt_for, mode_registry
+)
+from postprocess import extract_json_from_response
+from prompt_guard import estimate_tokens
+from resilient_llm import resilient_stream_text, LLMCallError
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".eval_cache.json")
+EVAL_CONCURRENCY = int(os.environ.get("EVAL_CONCURRENCY", "4"))
+
+DEFAULT_CORPUS = [
+    {"prompt": "How does the indian stock market work?", "mode": "clarity"},
+    {"prompt": "explain black holes", "mode": "teaching"},
+    {"prompt": "write a landing page for my todo app", "mode": "marketing_landing_page"},
+    {"prompt": "is remote work good for productivity", "mode": "contrarian"},
+    {"prompt": "how to set up a python project with tests", "mode": "step_by_step"},
+    {"prompt": "summarise the impact of AI on jobs", "mode": "executive_summary"},
+]
+
+# ========== CACHE ==========
+
+def cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+
+def load_cache() -> dict:
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    with open(CACHE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_cache(cache: dict):
+    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+
+# ========== SCORING ==========
+
+STRUCTURE_CUES = {
+    "role": r"\byou are\b|\bact as\b",
+    "format": r"\bformat\b|\bbullet|\bsection|\btable\b|\bheading|\bstep",
+    "audience": r"\baudience\b|\bbeginner|\bexpert|\breader",
+    "constraints": r"\bdo not\b|\bavoid\b|\bmust\b|\bonly\b",
+}
+COMMENTARY_OPENERS = ("here is", "here's", "sure", "certainly", "okay")
+
+
+def heuristic_score(original: str, optimized: str) -> float:
+    """0..1: keeps the user's intent, adds structure, and has no chatty preamble."""
+    if not optimized:
+        return 0.0
+    words = {w for w in re.findall(r"\w+", original.lower()) if len(w) > 3}
+    coverage = sum(w in optimized.lower() for w in words) / len(words) if words else 1.0
+    structure = sum(bool(re.search(p, optimized, re.IGNORECASE)) for p in STRUCTURE_CUES.values()) / len(STRUCTURE_CUES)
+    clean = not optimized.strip().lower().startswith(COMMENTARY_OPENERS)
+    return round(0.5 * coverage + 0.3 * structure + 0.2 * clean, 3)
+
+
+def judge_score(explanation: str):
+    """0..1 from the judge's explicit 1-10 rating of how well the output meets the mode's goal, or None."""
+    parsed = extract_json_from_response(explanation)
+    score = parsed.get("optimized_prompt_score") if isinstance(parsed, dict) else None
+    try:
+        return round(min(10.0, max(0.0, float(score))) / 10, 3)
+    except (TypeError, ValueError):
+        print(f"⚠️ Judge gave no usable score: {score!r}")
+        return None
+
+# ========== RUNNING ==========
+
+class Variant:
+    def __init__(self, config: dict):
+        self.name = config["name"]
+        self.model_name = config.get("model", DEFAULT_MODEL)
+        self.mode_overrides = config.get("modes", {})
+        self.prices = config.get("price_per_million")
+        self.llm = None if "model" not in config else init_chat_model(self.model_name, model_provider="google_genai")
+
+    def instructions(self):
+        return {**mode_registry.modes, **self.mode_overrides} if self.mode_overrides else None
+
+    def goal(self, mode: str) -> str:
+        return (self.instructions() or mode_registry.modes).get(mode, mode)
+
+    def system_prompt(self, mode: str) -> str:
+        instructions = self.instructions()
+        if instructions is not None:
+            return build_system_prompt(mode, instructions).content
+        return system_prompt_for(mode).content
+
+    def cost(self, input_tokens: int, output_tokens: int):
+        if not self.prices:
+            return None
+        return (input_tokens * self.prices["input"] + output_tokens * self.prices["output"]) / 1_000_000
+
+
+async def generate(variant: Variant, item: dict, cache: dict, semaphore: asyncio.Semaphore) -> dict:
+    prompt, mode = item["prompt"], item["mode"]
+    key = cache_key("generate", variant.model_name, variant.system_prompt(mode), prompt)
+    if key in cache:
+        return {**cache[key], "cached": True}
+
+    usage = {}
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            optimized = await resilient_stream_text(
+                lambda partial: optimize_prompt(
+                    prompt, mode, partial=partial, llm=variant.llm, instructions=variant.instructions()
+                ),
+                on_usage=usage.update,
+            )
+        except LLMCallError as e:
+            print(f"❌ {variant.name} failed on '{prompt[:40]}': {e}")
+            return {"optimized": e.partial, "latency": None, "input_tokens": 0, "output_tokens": 0,
+                    "cached": False, "failed": True}
+        latency = time.perf_counter() - started
+
+    record = {
+        "optimized": optimized,
+        "latency": latency,
+        # Fall back to the local estimate when the provider reports no usage
+        "input_tokens": usage.get("input_tokens") or estimate_tokens(variant.system_prompt(mode) + prompt),
+        "output_tokens": usage.get("output_tokens") or estimate_tokens(optimized),
+    }
+    cache[key] = record
+    return {**record, "cached": False}
+
+
+async def judge(variant: Variant, item: dict, optimized: str, judge_llm, judge_model: str, cache: dict,
+                semaphore):
+    """The judge's 0..1 score, or None when the call failed or the reply had no score."""
+    # Judged against the variant's own goal for the mode, so an overridden mode is not held to the live one
+    key = cache_key("judge", judge_model, item["prompt"], variant.goal(item["mode"]), optimized)
+    if key in cache:
+        return judge_score(cache[key]["explanation"])
+
+    async with semaphore:
+        try:
+            explanation = await resilient_stream_text(
+                lambda partial: explain_prompt(
+                    item["prompt"], optimized, item["mode"], partial=partial, llm=judge_llm,
+                    instructions=variant.instructions(), with_score=True,
+                )
+            )
+        except LLMCallError as e:
+            print(f"❌ Judge failed on '{item['prompt'][:40]}': {e}")
+            return None
+    score = judge_score(explanation)
+    # Only a usable judgement is cached, so the next run asks again instead of repeating the failure
+    if score is not None:
+        cache[key] = {"explanation": explanation}
+    return score
+
+
+async def evaluate(variants: list[Variant], corpus: list[dict], llm_judge: bool, concurrency: int) -> dict:
+    cache = load_cache()
+    semaphore = asyncio.Semaphore(concurrency)
+    judge_llm = None  # the live model judges every variant, so scores are comparable
+
+    try:
+        generations = await asyncio.gather(*(
+            generate(variant, item, cache, semaphore) for variant in variants for item in corpus
+        ))
+        rows = []
+        pairs = [(variant, item) for variant in variants for item in corpus]
+        for (variant, item), result in zip(pairs, generations):
+            rows.append({"variant": variant, "item": item, **result})
+
+        for row in rows:
+            row["heuristic"] = heuristic_score(row["item"]["prompt"], row["optimized"])
+        if llm_judge:
+            scores = await asyncio.gather(*(
+                judge(row["variant"], row["item"], row["optimized"], judge_llm, DEFAULT_MODEL, cache, semaphore)
+                if row["optimized"] else asyncio.sleep(0, 0.0)
+                for row in rows
+            ))
+            for row, score in zip(rows, scores):
+                row["judge"] = score
+    finally:
+        save_cache(cache)
+
+    return summarize(variants, rows)
+
+
+def summarize(variants: list[Variant], rows: list[dict]) -> dict:
+    report = {}
+    for variant in variants:
+        mine = [row for row in rows if row["variant"] is variant]
+        judged = [row["judge"] for row in mine if row.get("judge") is not None]
+        latencies = sorted(row["latency"] for row in mine if row["latency"] is not None)
+        input_tokens = sum(row["input_tokens"] for row in mine)
+        output_tokens = sum(row["output_tokens"] for row in mine)
+        report[variant.name] = {
+            "model": variant.model_name,
+            "items": len(mine),
+            "failed": sum(bool(row.get("failed")) for row in mine),
+            "cached": sum(row["cached"] for row in mine),
+            "heuristic": round(statistics.mean(row["heuristic"] for row in mine), 3) if mine else None,
+            # Failed judgements are counted, not averaged in as zeros
+            "judge": round(statistics.mean(judged), 3) if judged else None,
+            "judge_failed": sum("judge" in row and row["judge"] is None for row in mine),
+            "latency_p50": statistics.median(latencies) if latencies else None,
+            "latency_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": variant.cost(input_tokens, output_tokens),
+        }
+    return report
+
+
+def print_report(report: dict):
+    def fmt(value, spec):
+        # Keep the column width (e.g. ">6" of ">6.3f") for missing values
+        return format("-", re.match(r"[<>^]?\d*", spec).group()) if value is None else format(value, spec)
+
+    print(f"{'variant':<20} {'heur':>6} {'judge':>6} {'j fail':>6} {'p50 s':>7} {'p95 s':>7} "
+          f"{'in tok':>8} {'out tok':>8} {'cost $':>9} {'cached':>7}")
+    for name, r in report.items():
+        print(f"{name:<20} {fmt(r['heuristic'], '>6.3f')} {fmt(r['judge'], '>6.3f')} {r['judge_failed']:>6} "
+              f"{fmt(r['latency_p50'], '>7.2f')} {fmt(r['latency_p95'], '>7.2f')} "
+              f"{r['input_tokens']:>8} {r['output_tokens']:>8} {fmt(r['cost'], '>9.4f')} "
+              f"{r['cached']:>3}/{r['items']:<3}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare optimize_prompt variants offline")
+    parser.add_argument("variants", help="JSON file with a 'variants' list")
+    parser.add_argument("--corpus", help="JSON list of {prompt, mode}")
+    parser.add_argument("--llm-judge", action="store_true", help="also score outputs with explain_prompt")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    with open(args.variants, encoding="utf-8") as f:
+        variants = [Variant(config) for config in json.load(f)["variants"]]
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = json.load(f)
+
+    report = asyncio.run(evaluate(variants, corpus, args.llm_judge, args.concurrency))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -1,22 +1,43 @@
 import os
+import re
+import asyncio
 import logging
+import functools
+from collections import OrderedDict
 from io import StringIO
 from fastapi import FastAPI, Request
-from telegram import Update, InputFile
+from telegram import (
+    Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
-    ConversationHandler, ContextTypes, filters, AIORateLimiter
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
+    ConversationHandler, ContextTypes, filters, AIORateLimiter, BaseUpdateProcessor
 )
 from prompt_engine import (
-    optimize_prompt, explain_prompt, deep_research_questions,
+    mode_registry, optimize_prompt, explain_prompt, deep_research_questions,
     log_prompt_to_supabase, save_deep_research_questions_separately,
-    save_explanation_separately, extract_json_from_response
+    save_explanation_separately
+)
+from postprocess import (
+    split_for_telegram, parse_explanation, run_postprocess, postprocess_report, shutdown_postprocess
 )
+from resilient_llm import resilient_stream_text, LLMCallError
+from prompt_guard import preflight, record_token_usage, token_usage_report, PROMPT_MAX_TOKENS
 
 # ENVIRONMENT CONFIG
 TELEGRAM_BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
-BASE_URL = os.environ["RENDER_EXTERNAL_URL"]  # Render auto provides this
+RUN_MODE = os.environ.get("RUN_MODE", "webhook").lower()  # "webhook" or "polling"
+BASE_URL = os.environ.get("RENDER_EXTERNAL_URL")  # Render auto provides this, only needed for webhook mode
 WEBHOOK_SECRET = TELEGRAM_BOT_TOKEN  # secret path for webhook
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL")  # e.g. http://localhost:8081 for a local Bot API server or mock
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+PORT = int(os.environ.get("PORT", "8000"))
+
+if RUN_MODE not in ("webhook", "polling"):
+    raise ValueError(f"RUN_MODE must be 'webhook' or 'polling', got '{RUN_MODE}'")
+if RUN_MODE == "webhook" and not BASE_URL:
+    raise RuntimeError("RENDER_EXTERNAL_URL is required when RUN_MODE=webhook")
 
 # CONVERSATION STATES
 ASK_PROMPT, ASK_MODE, ASK_FOLLOWUP, ASK_EXPLAIN = range(4)
@@ -28,29 +49,168 @@ logger = logging.getLogger(__name__)
 # ========== UTILITIES ==========
 
 def get_send_strategy(response_text: str, filename: str = "response.txt"):
-    MAX_LENGTH = 4000
-    if len(response_text) <= MAX_LENGTH:
-        return "text", response_text
-    elif len(response_text) <= MAX_LENGTH * 5:
-        chunks = [response_text[i:i + MAX_LENGTH] for i in range(0, len(response_text), MAX_LENGTH)]
-        return "chunks", chunks
+    strategy, output = split_for_telegram(response_text)
+    if strategy == "file":
+        return "file", InputFile(StringIO(response_text), filename)
+    return strategy, output
+
+async def send_response(message, response_text: str):
+    """Send text, chunks or a file depending on length."""
+    # Splitting is at most five slices of an already short text, so it stays on the event loop
+    strategy, output = get_send_strategy(response_text)
+    if strategy == "text":
+        await message.reply_text(output)
+    elif strategy == "chunks":
+        for part in output:
+            await message.reply_text(part)
     else:
-        buffer = StringIO(response_text)
-        return "file", InputFile(buffer, filename)
-
-def format_explanation_to_messages(data: dict) -> list[str]:
-    messages = ["🧠 *Prompt Feedback Analysis*"]
+        await message.reply_document(output)
+
+async def generate_text(message, make_stream, **options):
+    """Run a streamed LLM call; fall back to partial output, or return None if nothing came back."""
+    try:
+        return await resilient_stream_text(make_stream, **options)
+    except LLMCallError as e:
+        logger.warning("⚠️ %s", e)
+        if not e.partial:
+            await message.reply_text("❌ The model is not responding right now. Please try again with /start.")
+            return None
+        await message.reply_text("⚠️ The model stopped early, here is what it produced so far:")
+        return e.partial
+
+def abortable(handler):
+    """
+    Let /cancel stop `handler` mid-way. The handler runs as its own task, registered in chat_data
+    next to a fresh abort flag; `cancel` sets the flag and cancels the task (and with it any model
+    call or post-processing it is awaiting). An aborted handler ends the conversation instead of
+    returning the state it was heading for.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update_or_message, context: ContextTypes.DEFAULT_TYPE):
+        abort = context.chat_data["abort"] = asyncio.Event()
+        task = context.chat_data["running"] = asyncio.ensure_future(handler(update_or_message, context))
+        try:
+            state = await task
+        except asyncio.CancelledError:
+            # Without the flag this is a shutdown, not a /cancel (Task.cancelling() needs 3.11)
+            if not abort.is_set():
+                raise
+            return ConversationHandler.END
+        finally:
+            if context.chat_data.get("running") is task:
+                del context.chat_data["running"]
+        # /cancel may land after the handler finished but before its state was stored
+        return ConversationHandler.END if abort.is_set() else state
+    return wrapper
+
+# ========== KEYBOARDS ==========
+
+MODES_PER_PAGE = 8
+MODE_COLUMNS = 2
+
+def build_mode_keyboards(mode_names) -> list[InlineKeyboardMarkup]:
+    names = list(mode_names)
+    pages = [names[i:i + MODES_PER_PAGE] for i in range(0, len(names), MODES_PER_PAGE)]
+    keyboards = []
+    for page_number, page in enumerate(pages):
+        rows = [
+            [InlineKeyboardButton(name, callback_data=f"mode:{name}") for name in page[i:i + MODE_COLUMNS]]
+            for i in range(0, len(page), MODE_COLUMNS)
+        ]
+        nav = []
+        if page_number > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"mode_page:{page_number - 1}"))
+        if page_number < len(pages) - 1:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"mode_page:{page_number + 1}"))
+        if nav:
+            rows.append(nav)
+        keyboards.append(InlineKeyboardMarkup(rows))
+    return keyboards
+
+def build_yes_no_keyboard(step: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Yes", callback_data=f"{step}:yes"),
+        InlineKeyboardButton("❌ No", callback_data=f"{step}:no"),
+    ]])
+
+# Built once up front and again only when the mode registry reloads
+MODE_KEYBOARDS = build_mode_keyboards(mode_registry.modes)
+FOLLOWUP_KEYBOARD = build_yes_no_keyboard("followup")
+EXPLAIN_KEYBOARD = build_yes_no_keyboard("explain")
+
+async def read_reply(update: Update):
+    """Return the message to reply to and the user's answer, for both typed text and button presses."""
+    query = update.callback_query
+    if query:
+        await query.answer()  # stop Telegram's loading spinner before doing any work
+        return query.message, query.data.split(":", 1)[1]
+    return update.message, update.message.text
+
+def rebuild_mode_keyboards(changed_modes):
+    global MODE_KEYBOARDS
+    MODE_KEYBOARDS = build_mode_keyboards(mode_registry.modes)
+
+mode_registry.add_listener(rebuild_mode_keyboards)
+
+# ========== UPDATE PROCESSING ==========
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently across chats while keeping each chat's updates in order.
 
-    if (s := data.get("original_prompt", {}).get("strengths", [])):
-        messages.append("👍 *Original Prompt Strengths*\n" + "\n".join(f"• {x}" for x in s))
-    if (w := data.get("original_prompt", {}).get("weaknesses", [])):
-        messages.append("👎 *Weaknesses*\n" + "\n".join(f"• {x}" for x in w))
-    if (u := data.get("llm_understanding_improvements", [])):
-        messages.append("🧠 *LLM Understands Better*\n" + "\n".join(f"• {x}" for x in u))
-    if (t := data.get("tips_for_future_prompts", [])):
-        messages.append("💡 *Tips*\n" + "\n".join(f"• {x}" for x in t))
+    The base class takes its own slot before calling do_process_update, so updates queued behind
+    a busy chat would sit on slots other chats need. Its limit is therefore set out of reach and
+    the real one is applied in do_process_update, after the chat lock.
+    """
 
-    return messages
+    BASE_LIMIT = 1_000_000
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        super().__init__(self.BASE_LIMIT)
+        self.update_limit = max_concurrent_updates
+        self._update_slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_waiters: dict[int, int] = {}
+
+    @staticmethod
+    def _ordering_key(update):
+        """The chat whose order the update must keep, or None if it can run right away."""
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            # Inline queries and the like have no chat to order against
+            return None
+        message = getattr(update, "message", None)
+        if message and message.text and message.text.startswith("/cancel"):
+            # /cancel must not queue behind the handler it is meant to abort
+            return None
+        return chat.id
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = self._ordering_key(update)
+        if chat_id is None:
+            async with self._update_slots:
+                await coroutine
+            return
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                async with self._update_slots:
+                    await coroutine
+        finally:
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
 
 # ========== BOT HANDLERS ==========
 
@@ -58,21 +218,82 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("👋 Welcome! Please send your raw prompt.")
     return ASK_PROMPT
 
+async def accept_prompt(message, context: ContextTypes.DEFAULT_TYPE, text: str) -> bool:
+    """Run the pre-flight length check and store the prompt; returns False if it was rejected."""
+    status, prompt, estimated = preflight(text)
+    if status == "reject":
+        await message.reply_text(
+            f"❌ Your prompt is too long (~{estimated} tokens, limit {PROMPT_MAX_TOKENS}). Please shorten it."
+        )
+        return False
+    if status == "compressed":
+        await message.reply_text(f"✂️ Your prompt was very long, so it was condensed to ~{estimated} tokens.")
+    elif status == "warn":
+        await message.reply_text(f"⏳ Long prompt (~{estimated} tokens), optimizing may take a while.")
+    context.user_data["prompt"] = prompt
+    context.user_data["prompt_tokens"] = estimated
+    return True
+
+async def optimize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /optimize [mode] <prompt> skips the steps that were already answered.
+    # The raw text is used rather than context.args, which would collapse the prompt's newlines.
+    match = re.match(r"/\S+\s*(.*)", update.message.text, re.DOTALL)
+    text = match.group(1).strip() if match else ""
+    parts = text.split(maxsplit=1)
+    if len(parts) == 2 and parts[0].lower() in mode_registry.modes:
+        if not await accept_prompt(update.message, context, parts[1]):
+            return ASK_PROMPT
+        context.user_data["mode"] = parts[0].lower()
+        return await run_optimization(update.message, context)
+    if text:
+        if not await accept_prompt(update.message, context, text):
+            return ASK_PROMPT
+        await update.message.reply_text("🔧 Choose the mode:", reply_markup=MODE_KEYBOARDS[0])
+        return ASK_MODE
+    await update.message.reply_text("👋 Please send your raw prompt.")
+    return ASK_PROMPT
+
 async def handle_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["prompt"] = update.message.text
-    await update.message.reply_text("🔧 Enter the mode (e.g., clarity, deep_research, creative, etc):")
+    if not await accept_prompt(update.message, context, update.message.text):
+        return ASK_PROMPT
+    await update.message.reply_text("🔧 Choose the mode:", reply_markup=MODE_KEYBOARDS[0])
+    return ASK_MODE
+
+async def handle_mode_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    # The keyboards may have been rebuilt with fewer pages since this one was sent
+    page = min(max(int(query.data.split(":", 1)[1]), 0), len(MODE_KEYBOARDS) - 1)
+    await query.edit_message_reply_markup(reply_markup=MODE_KEYBOARDS[page])
     return ASK_MODE
 
 async def handle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["mode"] = update.message.text
+    message, mode = await read_reply(update)
+    mode = mode.strip().lower()
+    if mode not in mode_registry.modes:
+        await message.reply_text(f"❓ Unknown mode '{mode}'. Please pick one:", reply_markup=MODE_KEYBOARDS[0])
+        return ASK_MODE
+    context.user_data["mode"] = mode
+    return await run_optimization(message, context)
+
+@abortable
+async def run_optimization(message, context: ContextTypes.DEFAULT_TYPE):
     prompt = context.user_data["prompt"]
     mode = context.user_data["mode"]
 
-    await update.message.reply_text("⚙️ Optimizing your prompt...")
+    await message.reply_text("⚙️ Optimizing your prompt...")
 
-    optimized = ""
-    for chunk in optimize_prompt(prompt, mode):
-        optimized += chunk.content
+    prompt_tokens = context.user_data.get("prompt_tokens", 0)
+    # Pin the mode definitions so the logged version is the one the prompt was generated with
+    snapshot = mode_registry.snapshot
+    optimized = await generate_text(
+        message,
+        lambda partial: optimize_prompt(prompt, mode, partial=partial, snapshot=snapshot),
+        hedge=True,
+        on_usage=lambda usage: record_token_usage(mode, prompt_tokens, usage),
+    )
+    if optimized is None:
+        return ConversationHandler.END
 
     context.user_data["optimized"] = optimized
     context.user_data["prompt_id"] = "telegram-user"
@@ -82,33 +303,28 @@ async def handle_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
             original_prompt=prompt,
             optimized_prompt=optimized,
             mode=mode,
-            model_used="gemini-2.5-flash"
+            model_used="gemini-2.5-flash",
+            mode_version=snapshot.versions.get(mode)
         )
         context.user_data["prompt_id"] = prompt_id
 
-    strategy, output = get_send_strategy(optimized)
-    if strategy == "text":
-        await update.message.reply_text(output)
-    elif strategy == "chunks":
-        for part in output:
-            await update.message.reply_text(part)
-    else:
-        await update.message.reply_document(output)
+    await send_response(message, optimized)
 
     if mode == "deep_research":
-        await update.message.reply_text("🤔 Want to answer follow-up questions? (yes/no)")
+        await message.reply_text("🤔 Want to answer follow-up questions?", reply_markup=FOLLOWUP_KEYBOARD)
         return ASK_FOLLOWUP
     else:
-        await update.message.reply_text("📘 Want explanation of the optimization? (yes/no)")
+        await message.reply_text("📘 Want explanation of the optimization?", reply_markup=EXPLAIN_KEYBOARD)
         return ASK_EXPLAIN
 
 async def handle_followup(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text.lower().startswith("y"):
-        await update.message.reply_text("✍️ Please enter the questions asked by the model:")
+    message, answer = await read_reply(update)
+    if answer.lower().startswith("y"):
+        await message.reply_text("✍️ Please enter the questions asked by the model:")
         context.user_data["wants_followup"] = True
         return ASK_FOLLOWUP + 10
     else:
-        await update.message.reply_text("📘 Want explanation of the optimization? (yes/no)")
+        await message.reply_text("📘 Want explanation of the optimization?", reply_markup=EXPLAIN_KEYBOARD)
         return ASK_EXPLAIN
 
 async def collect_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,18 +332,23 @@ async def collect_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("💬 Any preferences/answers to the questions? (or type 'no')")
     return ASK_FOLLOWUP + 11
 
+@abortable
 async def collect_answers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     preferences = update.message.text
     if preferences.lower() == "no":
         preferences = ""
     context.user_data["preferences"] = preferences
 
+    prompt = context.user_data["prompt"]
     questions = context.user_data["questions_asked"]
     answers = context.user_data["optimized"]
 
-    response = ""
-    for chunk in deep_research_questions(questions, answers, preferences):
-        response += chunk.content
+    response = await generate_text(
+        update.message,
+        lambda partial: deep_research_questions(prompt, answers, questions, preferences, partial=partial)
+    )
+    if response is None:
+        return ConversationHandler.END
 
     save_deep_research_questions_separately(
         prompt_id=context.user_data.get("prompt_id", "telegram-user"),
@@ -136,47 +357,176 @@ async def collect_answers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         preferences=preferences
     )
 
-    strategy, output = get_send_strategy(response)
-    if strategy == "text":
-        await update.message.reply_text(output)
-    elif strategy == "chunks":
-        for part in output:
-            await update.message.reply_text(part)
-    else:
-        await update.message.reply_document(output)
+    await send_response(update.message, response)
 
-    await update.message.reply_text("📘 Want explanation of the optimization? (yes/no)")
+    await update.message.reply_text("📘 Want explanation of the optimization?", reply_markup=EXPLAIN_KEYBOARD)
     return ASK_EXPLAIN
 
+@abortable
 async def handle_explain(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text.lower().startswith("y"):
+    message, answer = await read_reply(update)
+    if answer.lower().startswith("y"):
         prompt = context.user_data["prompt"]
         optimized = context.user_data["optimized"]
         mode = context.user_data["mode"]
 
-        explanation = ""
-        for chunk in explain_prompt(prompt, optimized, mode):
-            explanation += chunk.content
+        explanation = await generate_text(
+            message, lambda partial: explain_prompt(prompt, optimized, mode, partial=partial)
+        )
+        if explanation is None:
+            return ConversationHandler.END
 
-        parsed = extract_json_from_response(explanation)
+        parsed, messages = await run_postprocess(parse_explanation, explanation, size=len(explanation))
         if parsed:
             save_explanation_separately(
                 context.user_data.get("prompt_id", "telegram-user"),
                 parsed
             )
-            messages = format_explanation_to_messages(parsed)
             for msg in messages:
-                await update.message.reply_text(msg, parse_mode="Markdown")
+                await message.reply_text(msg, parse_mode="Markdown")
         else:
-            await update.message.reply_text(explanation)
+            await message.reply_text(explanation)
     else:
-        await update.message.reply_text("✅ Done. You can send another prompt with /start.")
+        await message.reply_text("✅ Done. You can send another prompt with /start or /optimize <mode> <prompt>.")
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Stop the handler still working on this chat, see `abortable`
+    abort = context.chat_data.get("abort")
+    if abort is not None:
+        abort.set()
+    running = context.chat_data.get("running")
+    if running is not None:
+        running.cancel()
     await update.message.reply_text("❌ Canceled.")
     return ConversationHandler.END
 
+# ========== INLINE MODE ==========
+
+INLINE_MODES = ("clarity", "concise", "structured")
+INLINE_DEBOUNCE_SECONDS = 0.7   # wait for the user to stop typing before generating
+INLINE_ANSWER_TIMEOUT = 8       # Telegram drops inline answers sent after ~10s
+INLINE_CACHE_TIME = 300         # seconds Telegram may serve our answer from its own cache
+INLINE_CACHE_SIZE = 256
+INLINE_MAX_MESSAGE_LENGTH = 4096
+# Model calls (each with its own worker thread) shared by all inline queries, 3 per query;
+# inline generation runs outside the update processor, so this is its only limit
+INLINE_MAX_GENERATIONS = int(os.environ.get("INLINE_MAX_GENERATIONS", "6"))
+
+# (mode, mode version, query text) -> optimized prompt
+inline_result_cache: OrderedDict[tuple, str] = OrderedDict()
+inline_tasks: dict[int, asyncio.Task] = {}
+inline_generation_slots = asyncio.Semaphore(INLINE_MAX_GENERATIONS)
+
+def build_inline_results(optimized_by_mode: list[tuple[str, str]]) -> list[InlineQueryResultArticle]:
+    return [
+        InlineQueryResultArticle(
+            id=mode,
+            title=f"✨ {mode}",
+            description=optimized[:100],
+            input_message_content=InputTextMessageContent(optimized[:INLINE_MAX_MESSAGE_LENGTH]),
+        )
+        for mode, optimized in optimized_by_mode
+        if optimized
+    ]
+
+def inline_cache_key(mode: str, text: str, snapshot=None) -> tuple:
+    snapshot = snapshot or mode_registry.snapshot
+    return mode, snapshot.versions.get(mode), text
+
+def cached_inline_results(text: str) -> dict[str, str]:
+    cached = {}
+    for mode in INLINE_MODES:
+        key = inline_cache_key(mode, text)
+        if key in inline_result_cache:
+            inline_result_cache.move_to_end(key)
+            cached[mode] = inline_result_cache[key]
+    return cached
+
+def invalidate_inline_cache(changed_modes):
+    for key in [key for key in inline_result_cache if key[0] in changed_modes]:
+        del inline_result_cache[key]
+
+mode_registry.add_listener(invalidate_inline_cache)
+
+async def generate_inline(text: str, mode: str, snapshot) -> str:
+    # No retries: a late answer is useless to an inline query
+    async with inline_generation_slots:
+        return await resilient_stream_text(
+            lambda partial: optimize_prompt(text, mode, partial=partial, snapshot=snapshot),
+            max_retries=0,
+            total_timeout=INLINE_ANSWER_TIMEOUT,
+        )
+
+async def answer_inline_query(inline_query, text: str, cached: dict[str, str]):
+    await asyncio.sleep(INLINE_DEBOUNCE_SECONDS)
+
+    # Only modes missing from the cache (e.g. just reloaded) are generated again.
+    # Results are cached under the version they were generated with, even if a reload lands meanwhile.
+    snapshot = mode_registry.snapshot
+    tasks = {
+        asyncio.create_task(generate_inline(text, mode, snapshot)): mode
+        for mode in INLINE_MODES
+        if mode not in cached
+    }
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=INLINE_ANSWER_TIMEOUT)
+    finally:
+        # Reached on timeout and when a newer query cancels us; cancelling stops the streams
+        for task in tasks:
+            task.cancel()
+
+    results = dict(cached)
+    for task in done:
+        if not task.exception():
+            mode = tasks[task]
+            results[mode] = task.result()
+            inline_result_cache[inline_cache_key(mode, text, snapshot)] = results[mode]
+    while len(inline_result_cache) > INLINE_CACHE_SIZE:
+        inline_result_cache.popitem(last=False)
+
+    optimized_by_mode = [(mode, results[mode]) for mode in INLINE_MODES if mode in results]
+    complete = len(optimized_by_mode) == len(INLINE_MODES)
+
+    # Partial answers are still useful but must not be cached by Telegram either
+    await inline_query.answer(
+        build_inline_results(optimized_by_mode),
+        cache_time=INLINE_CACHE_TIME if complete else 0,
+    )
+
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    text = inline_query.query.strip()
+    user_id = inline_query.from_user.id
+
+    # Every keystroke sends a new query; whatever was running for this user is now stale
+    previous = inline_tasks.pop(user_id, None)
+    if previous:
+        previous.cancel()
+
+    if not text:
+        return
+
+    cached = cached_inline_results(text)
+    if len(cached) == len(INLINE_MODES):
+        await inline_query.answer(
+            build_inline_results([(mode, cached[mode]) for mode in INLINE_MODES]),
+            cache_time=INLINE_CACHE_TIME,
+        )
+        return
+
+    # Generation runs outside the handler so other updates are not blocked by the debounce
+    task = asyncio.create_task(answer_inline_query(inline_query, text, cached))
+    inline_tasks[user_id] = task
+
+    def forget(finished: asyncio.Task):
+        if inline_tasks.get(user_id) is finished:
+            del inline_tasks[user_id]
+        if not finished.cancelled() and finished.exception():
+            logger.warning("⚠️ Inline query failed: %s", finished.exception())
+
+    task.add_done_callback(forget)
+
 # ========== FASTAPI SERVER ==========
 
 from contextlib import asynccontextmanager
@@ -188,36 +538,81 @@ async def lifespan(app: FastAPI):
     await telegram_app.initialize()
     await telegram_app.bot.set_webhook(f"{BASE_URL}/webhook/{WEBHOOK_SECRET}")
     await telegram_app.start()  # ← REQUIRED to process updates!
+    await start_mode_watcher(telegram_app)  # post_init only runs under run_polling
     yield
-    # (Optional) Cleanup logic on shutdown goes here
+    await stop_mode_watcher(telegram_app)
+    await telegram_app.stop()
+    await telegram_app.shutdown()
+    shutdown_postprocess()
 
 app = FastAPI(lifespan=lifespan)
 
-telegram_app = (
+mode_watcher = None
+
+async def start_mode_watcher(application):
+    global mode_watcher
+    mode_watcher = asyncio.create_task(mode_registry.watch())
+
+async def stop_mode_watcher(application):
+    if mode_watcher:
+        mode_watcher.cancel()
+
+telegram_builder = (
     ApplicationBuilder()
     .token(TELEGRAM_BOT_TOKEN)
     .rate_limiter(AIORateLimiter())
-    .build()
+    .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    .post_init(start_mode_watcher)
+    .post_shutdown(stop_mode_watcher)
 )
+if BOT_API_BASE_URL:
+    telegram_builder = (
+        telegram_builder
+        .base_url(f"{BOT_API_BASE_URL}/bot")
+        .base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+    )
+telegram_app = telegram_builder.build()
 
 conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("start", start)],
+    entry_points=[CommandHandler("start", start), CommandHandler("optimize", optimize_command)],
     states={
         ASK_PROMPT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_prompt)],
-        ASK_MODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_mode)],
-        ASK_FOLLOWUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_followup)],
+        ASK_MODE: [
+            CallbackQueryHandler(handle_mode_page, pattern=r"^mode_page:\d+$"),
+            CallbackQueryHandler(handle_mode, pattern=r"^mode:"),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_mode),
+        ],
+        ASK_FOLLOWUP: [
+            CallbackQueryHandler(handle_followup, pattern=r"^followup:"),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_followup),
+        ],
         ASK_FOLLOWUP + 10: [MessageHandler(filters.TEXT & ~filters.COMMAND, collect_questions)],
         ASK_FOLLOWUP + 11: [MessageHandler(filters.TEXT & ~filters.COMMAND, collect_answers)],
-        ASK_EXPLAIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_explain)],
+        ASK_EXPLAIN: [
+            CallbackQueryHandler(handle_explain, pattern=r"^explain:"),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_explain),
+        ],
     },
-    fallbacks=[CommandHandler("cancel", cancel)]
+    fallbacks=[CommandHandler("cancel", cancel)],
+    allow_reentry=True
 )
 telegram_app.add_handler(conv_handler)
+telegram_app.add_handler(InlineQueryHandler(handle_inline_query))
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/token-usage")
+async def token_usage():
+    # Estimated prompt tokens vs tokens reported by the model, per mode, for tuning the limits
+    return token_usage_report()
+
+@app.get("/postprocess-stats")
+async def postprocess_stats():
+    # Inline vs offloaded post-processing jobs and how long offloaded jobs waited for a worker
+    return postprocess_report()
+
 from fastapi.responses import HTMLResponse
 
 @app.get("/", response_class=HTMLResponse)
@@ -238,3 +633,14 @@ async def telegram_webhook(request: Request):
     await telegram_app.update_queue.put(update)
     return {"ok": True}
 
+
+# ========== ENTRY POINT ==========
+
+if __name__ == "__main__":
+    if RUN_MODE == "polling":
+        # run_polling removes any registered webhook before fetching updates
+        telegram_app.run_polling(allowed_updates=Update.ALL_TYPES)
+        shutdown_postprocess()
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -0,0 +1,125 @@
+"""
+Mode definitions that can change without a redeploy.
+
+MODES_SOURCE selects where they come from:
+  builtin   the `modes` dict in prompt_engine.py (default, no reloading)
+  file      a JSON file (MODES_FILE), reloaded when its mtime/size changes:
+            {"version": 3, "modes": {"clarity": {"instruction": "...", "version": 2}, "concise": "..."}}
+            a bare string uses the file version as the mode version
+  supabase  rows of MODES_TABLE (name, instruction, version), reloaded when any version changes
+
+Readers always see one complete snapshot; a reload swaps it in a single assignment and tells
+listeners which modes changed so they can drop only those cache entries.
+"""
+import asyncio
+import json
+import os
+from collections import namedtuple
+
+MODES_SOURCE = os.environ.get("MODES_SOURCE", "builtin")
+MODES_FILE = os.environ.get("MODES_FILE", "modes.json")
+MODES_TABLE = os.environ.get("MODES_TABLE", "prompt_modes")
+MODES_POLL_SECONDS = float(os.environ.get("MODES_POLL_SECONDS", "30"))
+
+ModeSnapshot = namedtuple("ModeSnapshot", ["version", "instructions", "versions", "etag"])
+
+
+def parse_modes_document(document: dict, etag) -> ModeSnapshot:
+    file_version = document.get("version", 0)
+    instructions, versions = {}, {}
+    for name, definition in document["modes"].items():
+        if isinstance(definition, str):
+            instructions[name], versions[name] = definition, file_version
+        else:
+            instructions[name] = definition["instruction"]
+            versions[name] = definition.get("version", file_version)
+    return ModeSnapshot(file_version, instructions, versions, etag)
+
+
+class ModeRegistry:
+    def __init__(self, default_modes: dict, source=MODES_SOURCE, path=MODES_FILE, client=None):
+        self.source = source
+        self.path = path
+        self.client = client
+        self._snapshot = ModeSnapshot(0, dict(default_modes), {name: 0 for name in default_modes}, None)
+        self._listeners = []
+
+    @property
+    def snapshot(self) -> ModeSnapshot:
+        return self._snapshot
+
+    @property
+    def modes(self) -> dict:
+        return self._snapshot.instructions
+
+    def add_listener(self, listener):
+        """`listener(changed_modes: set[str])` is called after every swap that changed something."""
+        self._listeners.append(listener)
+
+    # ---------- loading (blocking, safe to run in a worker thread) ----------
+
+    def _fetch_file(self):
+        stat = os.stat(self.path)
+        etag = (stat.st_mtime_ns, stat.st_size)
+        if etag == self._snapshot.etag:
+            return None
+        with open(self.path, encoding="utf-8") as f:
+            return parse_modes_document(json.load(f), etag)
+
+    def _fetch_supabase(self):
+        rows = self.client.table(MODES_TABLE).select("name,instruction,version").execute().data or []
+        etag = tuple(sorted((row["name"], row["version"]) for row in rows))
+        if etag == self._snapshot.etag:
+            return None
+        return ModeSnapshot(
+            max((row["version"] for row in rows), default=0),
+            {row["name"]: row["instruction"] for row in rows},
+            {row["name"]: row["version"] for row in rows},
+            etag,
+        )
+
+    def fetch(self):
+        """Return a new snapshot if the source changed since the last one, else None."""
+        if self.source == "file":
+            return self._fetch_file()
+        if self.source == "supabase":
+            return self._fetch_supabase()
+        return None
+
+    # ---------- swapping ----------
+
+    def apply(self, snapshot: ModeSnapshot) -> set:
+        if not snapshot.instructions:
+            print("⚠️ Ignoring empty mode registry.")
+            # Remember its etag so the same empty source is not fetched and reported again every poll
+            self._snapshot = self._snapshot._replace(etag=snapshot.etag)
+            return set()
+        old = self._snapshot
+        changed = {
+            name for name in old.instructions.keys() | snapshot.instructions.keys()
+            if old.instructions.get(name) != snapshot.instructions.get(name)
+            or old.versions.get(name) != snapshot.versions.get(name)
+        }
+        self._snapshot = snapshot
+        if changed:
+            print(f"🔄 Modes reloaded (v{snapshot.version}), changed: {', '.join(sorted(changed))}")
+            for listener in self._listeners:
+                listener(changed)
+        return changed
+
+    def reload(self) -> set:
+        snapshot = self.fetch()
+        return self.apply(snapshot) if snapshot else set()
+
+    async def watch(self, interval=MODES_POLL_SECONDS):
+        if self.source == "builtin":
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                snapshot = await asyncio.to_thread(self.fetch)
+                if snapshot:
+                    # Swap on the event loop so listeners never race with handlers
+                    self.apply(snapshot)
+            except Exception as e:
+                print(f"❌ Failed to reload modes: {e}")
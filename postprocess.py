@@ -0,0 +1,150 @@
+"""
+CPU-bound post-processing of model output.
+
+Kept free of Telegram/LangChain/Supabase imports so process-pool workers start cheaply.
+Small outputs are processed inline; large ones go to a bounded executor so a very long
+deep_research answer does not stall every other chat on the event loop.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import threading
+import time
+
+MAX_MESSAGE_LENGTH = 4000
+MAX_CHUNKED_LENGTH = MAX_MESSAGE_LENGTH * 5
+
+# Measured on a 2MB output, JSON extraction takes ~1.5ms and pickling the text for a process
+# costs about the same, so only really large outputs are worth moving off the event loop.
+# "process" avoids the GIL for genuinely heavy work; "thread" skips the pickling round trip.
+POSTPROCESS_INLINE_CHARS = int(os.environ.get("POSTPROCESS_INLINE_CHARS", "200000"))
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", "2"))
+POSTPROCESS_EXECUTOR = os.environ.get("POSTPROCESS_EXECUTOR", "thread")  # "thread" or "process"
+
+# ========== PURE FUNCTIONS ==========
+
+def split_for_telegram(response_text: str):
+    """Return ("text", str), ("chunks", list[str]) or ("file", None) depending on the length."""
+    if len(response_text) <= MAX_MESSAGE_LENGTH:
+        return "text", response_text
+    elif len(response_text) <= MAX_CHUNKED_LENGTH:
+        chunks = [response_text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(response_text), MAX_MESSAGE_LENGTH)]
+        return "chunks", chunks
+    else:
+        return "file", None
+
+
+def extract_json_from_response(response_text: str):
+    # Strip code block formatting (e.g., ```json ... ```)
+    json_str = re.search(r"```json\s+(.*?)```", response_text, re.DOTALL)
+    if json_str:
+        candidate = json_str.group(1)
+    else:
+        # The prompt asks for bare JSON, so take the outermost {...} around any stray text
+        start, end = response_text.find("{"), response_text.rfind("}")
+        if start == -1 or end < start:
+            print("⚠️ JSON block not found.")
+            return None
+        candidate = response_text[start:end + 1]
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError as e:
+        print(f"⚠️ JSON decode error: {e}")
+    return None
+
+
+def format_explanation_to_messages(data: dict) -> list[str]:
+    messages = ["🧠 *Prompt Feedback Analysis*"]
+
+    if (s := data.get("original_prompt", {}).get("strengths", [])):
+        messages.append("👍 *Original Prompt Strengths*\n" + "\n".join(f"• {x}" for x in s))
+    if (w := data.get("original_prompt", {}).get("weaknesses", [])):
+        messages.append("👎 *Weaknesses*\n" + "\n".join(f"• {x}" for x in w))
+    if (u := data.get("llm_understanding_improvements", [])):
+        messages.append("🧠 *LLM Understands Better*\n" + "\n".join(f"• {x}" for x in u))
+    if (t := data.get("tips_for_future_prompts", [])):
+        messages.append("💡 *Tips*\n" + "\n".join(f"• {x}" for x in t))
+
+    return messages
+
+
+def parse_explanation(explanation: str):
+    """Return (parsed_json, formatted_messages), or (None, None) if the model sent no JSON."""
+    parsed = extract_json_from_response(explanation)
+    if not parsed:
+        return None, None
+    return parsed, format_explanation_to_messages(parsed)
+
+# ========== EXECUTOR ==========
+
+_executor = None
+_lock = threading.Lock()
+
+postprocess_metrics = {
+    "inline": 0,
+    "offloaded": 0,
+    "cancelled": 0,
+    "queue_wait_total": 0.0,
+    "queue_wait_max": 0.0,
+}
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            if POSTPROCESS_EXECUTOR == "thread":
+                _executor = concurrent.futures.ThreadPoolExecutor(POSTPROCESS_WORKERS, thread_name_prefix="postprocess")
+            else:
+                _executor = concurrent.futures.ProcessPoolExecutor(POSTPROCESS_WORKERS)
+        return _executor
+
+
+def _timed_call(func, args):
+    # Wall clock, because the start time is compared with the submit time in another process
+    return time.time(), func(*args)
+
+
+async def run_postprocess(func, *args, size: int):
+    """
+    Run `func(*args)` inline when `size` is small, otherwise in the worker pool.
+    Cancelling the caller (e.g. /cancel aborting a handler) also drops a job no worker picked up
+    yet; a job a worker already started runs to completion, but its result is dropped.
+    """
+    if size < POSTPROCESS_INLINE_CHARS:
+        postprocess_metrics["inline"] += 1
+        return func(*args)
+
+    submitted_at = time.time()
+    future = asyncio.wrap_future(_get_executor().submit(_timed_call, func, args))
+    try:
+        started_at, result = await future
+    except asyncio.CancelledError:
+        postprocess_metrics["cancelled"] += 1
+        raise
+
+    queue_wait = max(0.0, started_at - submitted_at)
+    postprocess_metrics["offloaded"] += 1
+    postprocess_metrics["queue_wait_total"] += queue_wait
+    postprocess_metrics["queue_wait_max"] = max(postprocess_metrics["queue_wait_max"], queue_wait)
+    return result
+
+
+def postprocess_report() -> dict:
+    offloaded = postprocess_metrics["offloaded"]
+    return {
+        **postprocess_metrics,
+        "queue_wait_avg": postprocess_metrics["queue_wait_total"] / offloaded if offloaded else 0.0,
+        "workers": POSTPROCESS_WORKERS,
+        "executor": POSTPROCESS_EXECUTOR,
+    }
+
+
+def shutdown_postprocess():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
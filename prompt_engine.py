@@ -34,10 +34,31 @@ modes = {
     "socratic_reverse": "Rewrite the prompt to make the LLM ask a sequence of layered, increasingly specific questions back to the user in order to clarify the problem or uncover blind spots.",
     "satirical": "Rewrite the prompt so that the LLM responds with sarcasm, exaggeration, or parody — in the style of satirical commentary or mockery of the topic.",
 }
-# Optimizer function
-def optimize_prompt(raw_prompt, mode="clarity"):
 
-    
+def with_continuation(messages, partial=""):
+    # Resume an interrupted stream: show the model what it already wrote and ask it to go on
+    if not partial:
+        return messages
+    return messages + [
+        AIMessage(partial),
+        HumanMessage("Continue exactly where you stopped. Do not repeat anything you already wrote."),
+    ]
+
+from mode_registry import ModeRegistry
+
+# Live view of the modes; starts from the dict above and may be reloaded at runtime (see mode_registry.py)
+mode_registry = ModeRegistry(modes)
+
+# System prompts for registered modes, keyed on (mode, mode version) so a reload never serves a stale one
+_system_prompt_cache = {}
+
+def invalidate_mode_caches(changed_modes):
+    for key in [key for key in _system_prompt_cache if key[0] in changed_modes]:
+        _system_prompt_cache.pop(key, None)
+
+mode_registry.add_listener(invalidate_mode_caches)
+
+def build_system_prompt(mode, instructions):
     if mode == "deep_research":
         system = SystemMessage(
         f"""
@@ -50,7 +71,7 @@ def optimize_prompt(raw_prompt, mode="clarity"):
     ⚠️ CRITICAL INSTRUCTION: Do NOT output any commentary, apologies, or explanations. Output ONLY the **final refined prompt** as plain text.
     """.strip()
     )
-    elif mode in modes:
+    elif mode in instructions:
         system = SystemMessage(
         f"""
     Act as a world-class prompt engineering expert.
@@ -69,7 +90,7 @@ def optimize_prompt(raw_prompt, mode="clarity"):
     6. Key Elements — Include concepts, examples, analogies, pitfalls, comparisons, and optional depth levels.
     7. Constraints — Add exclusions if appropriate (e.g., “Do not include political commentary”).
 
-    🎯 MOST IMPORTANT INSTRUCTION: **{modes[mode]}**
+    🎯 MOST IMPORTANT INSTRUCTION: **{instructions[mode]}**
 
     ⚠️ CRITICAL INSTRUCTION: Do NOT output any commentary, apologies, or explanations. Output ONLY the **final refined prompt** as plain text.
     """.strip()
@@ -98,14 +119,42 @@ def optimize_prompt(raw_prompt, mode="clarity"):
     ⚠️ CRITICAL INSTRUCTION: Do NOT output any commentary, apologies, or explanations. Output ONLY the **final refined prompt** as plain text.
     """.strip()
     )
+    return system
+
+def system_prompt_for(mode, snapshot=None):
+    snapshot = snapshot or mode_registry.snapshot
+    if mode not in snapshot.instructions:
+        # Free-text instructions are not cached, there is no bound on how many there are
+        return build_system_prompt(mode, snapshot.instructions)
+    key = (mode, snapshot.versions.get(mode))
+    system = _system_prompt_cache.get(key)
+    if system is None:
+        system = _system_prompt_cache[key] = build_system_prompt(mode, snapshot.instructions)
+    return system
 
-
+# Optimizer function
+def optimize_prompt(raw_prompt, mode="clarity", partial="", llm=None, instructions=None, snapshot=None):
+    # `llm` and `instructions` override the live model and modes, e.g. for offline evaluation.
+    # `snapshot` pins the mode definitions, so a caller can log/cache the version it actually used.
+    if instructions is not None:
+        system = build_system_prompt(mode, instructions)
+    else:
+        system = system_prompt_for(mode, snapshot)
     user = HumanMessage(f"Optimise this: {raw_prompt}")
-    return model.stream([system, user])
-
-def explain_prompt(original_prompt, optimized_prompt, mode="clarity"):
-    if mode in modes:
-        mode=modes[mode]
+    return (llm or model).stream(with_continuation([system, user], partial))
+
+def explain_prompt(original_prompt, optimized_prompt, mode="clarity", partial="", llm=None,
+                   instructions=None, with_score=False):
+    # `instructions` overrides the live modes; `with_score` also asks for a 1-10 rating (used by evaluate.py)
+    if instructions is None:
+        instructions = mode_registry.modes
+    if mode in instructions:
+        mode=instructions[mode]
+    score_field = '"optimized_prompt_score": <1-10>,\n  ' if with_score else ""
+    score_rule = (
+        '- "optimized_prompt_score" is an integer from 1 to 10 rating how well the optimized prompt achieves the final goal.\n'
+        if with_score else ""
+    )
     explanation_request = HumanMessage(f"""
 Act as a world-class prompt engineering expert.
 
@@ -123,7 +172,7 @@ Compare the following two prompts and return a structured analysis in **valid JS
 Return exactly this JSON object structure:
 
 {{
-  "original_prompt": {{
+  {score_field}"original_prompt": {{
     "strengths": ["..."],
     "weaknesses": ["..."]
   }},
@@ -151,13 +200,13 @@ Return exactly this JSON object structure:
 ⚠️ Important Instructions:
 - Do NOT output anything other than the JSON object.
 - Make sure the response is valid JSON and not a markdown code block.
-""")
+{score_rule}""")
 
     system = SystemMessage("You are a prompt engineer. You need to explain your own work.")
-    return model.stream([system, explanation_request])
+    return (llm or model).stream(with_continuation([system, explanation_request], partial))
     
 
-def deep_research_questions(original_prompt,optimised_prompt,questions_asked,preferences=""):
+def deep_research_questions(original_prompt,optimised_prompt,questions_asked,preferences="",partial=""):
     if preferences:
         new_message_from_human= HumanMessage(
             f"""The model has asked the following questions:{questions_asked}
@@ -184,24 +233,10 @@ def deep_research_questions(original_prompt,optimised_prompt,questions_asked,pre
     ⚠️ CRITICAL INSTRUCTION: Do NOT output any commentary, apologies, or explanations. Output ONLY the **final refined prompt** as plain text.
     """.strip()
     )
-    return model.stream([system,HumanMessage(f"Optimise this: {original_prompt}"),AIMessage(optimised_prompt),new_message_from_human])
-
+    return model.stream(with_continuation([system,HumanMessage(f"Optimise this: {original_prompt}"),AIMessage(optimised_prompt),new_message_from_human], partial))
 
-import json
-import re
 
-def extract_json_from_response(response_text: str):
-    # Strip code block formatting (e.g., ```json ... ```)
-    json_str = re.search(r"```json\s+(.*?)```", response_text, re.DOTALL)
-    if json_str:
-        try:
-            return json.loads(json_str.group(1))
-        except json.JSONDecodeError as e:
-            print(f"⚠️ JSON decode error: {e}")
-    else:
-        print("⚠️ JSON block not found.")
-        print(json_str)
-    return None
+from postprocess import extract_json_from_response  # kept importable from here
 
 
 from supabase import create_client
@@ -221,13 +256,20 @@ base_api.SyncGoTrueBaseAPI.__init__ = _patched_init
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+mode_registry.client = supabase
+try:
+    mode_registry.reload()
+except Exception as e:
+    print(f"❌ Failed to load modes from {mode_registry.source}, using built-in modes: {e}")
+
 def log_prompt_to_supabase(
     original_prompt,
     optimized_prompt,
     mode,
     model_used="gemini-2.5-flash",
     user_location="global",
-    session_id=None
+    session_id=None,
+    mode_version=None
 ):
     session_id = session_id or str(uuid.uuid4())
     timestamp = datetime.datetime.utcnow().isoformat()
@@ -239,7 +281,8 @@ def log_prompt_to_supabase(
         "model_used": model_used,
         "timestamp": timestamp,
         "session_id": session_id,
-        "user_location": user_location
+        "user_location": user_location,
+        "mode_version": mode_version
     }
 
 
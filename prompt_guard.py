@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+
+# Limits are in estimated tokens of the raw prompt, before the system prompt is added
+PROMPT_WARN_TOKENS = int(os.environ.get("PROMPT_WARN_TOKENS", "2000"))
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "8000"))
+PROMPT_COMPRESS = os.environ.get("PROMPT_COMPRESS", "1") == "1"
+# Share of the budget kept from the start of the prompt when trimming; the rest comes from the end
+HEAD_SHARE = 0.7
+TRIM_MARKER = "\n[...]\n"
+
+
+def estimate_tokens(text: str) -> int:
+    # Gemini/GPT tokenizers average ~4 characters per token for English,
+    # but short words and punctuation push the count up, so take the larger estimate
+    if not text:
+        return 0
+    by_chars = len(text) / 4
+    by_words = len(re.findall(r"\w+|[^\w\s]", text)) * 0.75
+    return int(max(by_chars, by_words)) + 1
+
+
+def normalize_whitespace(text: str) -> str:
+    # Only whitespace that carries nothing: trailing spaces and runs of blank lines.
+    # Leading indentation and inner spacing stay, pasted code and tables depend on them.
+    text = re.sub(r"[ \t]+$", "", text, flags=re.MULTILINE)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip("\n")
+
+
+def drop_repeated_blocks(text: str) -> str:
+    # Pasted logs and chat exports often repeat whole paragraphs or lines verbatim
+    seen = set()
+    kept_paragraphs = []
+    for paragraph in text.split("\n\n"):
+        kept_lines = []
+        for line in paragraph.split("\n"):
+            key = line.strip().lower()
+            if len(key) > 20 and key in seen:
+                continue
+            seen.add(key)
+            kept_lines.append(line)
+        if kept_lines:
+            kept_paragraphs.append("\n".join(kept_lines))
+    return "\n\n".join(kept_paragraphs)
+
+
+def cut_to_budget(text: str, max_tokens: int) -> str:
+    """Hard cut: the longest prefix whose estimate fits, found by bisecting on its length."""
+    # The estimate never shrinks as the prefix grows, and is at least len / 4
+    low, high = 0, min(len(text), max_tokens * 4)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def trim_to_budget(text: str, max_tokens: int) -> str:
+    """Extractive trim: keep whole sentences from the start and the end, drop the middle."""
+    # Each sentence keeps the whitespace before it, so line breaks and indentation survive the join
+    pieces = re.split(r"(?<=[.!?\n])(\s+)", text)
+    sentences = [pieces[0]] + [pieces[k] + pieces[k + 1] for k in range(1, len(pieces) - 1, 2)]
+    head, tail = [], []
+    head_budget = int(max_tokens * HEAD_SHARE)
+    used = 0
+    i = 0
+    while i < len(sentences) and used + estimate_tokens(sentences[i]) <= head_budget:
+        used += estimate_tokens(sentences[i])
+        head.append(sentences[i])
+        i += 1
+    j = len(sentences) - 1
+    while j >= i and used + estimate_tokens(sentences[j]) <= max_tokens:
+        used += estimate_tokens(sentences[j])
+        tail.insert(0, sentences[j])
+        j -= 1
+    if not head and not tail:
+        # A single giant "sentence" (one long line, minified JSON...): fall back to a hard cut
+        return cut_to_budget(text, max_tokens)
+    if i > j:
+        trimmed = "".join(head + tail)
+    else:
+        trimmed = "".join(head) + TRIM_MARKER + "".join(tail).lstrip("\n")
+    # The joining spaces and the marker are not part of the per-sentence estimates
+    if estimate_tokens(trimmed) > max_tokens:
+        trimmed = cut_to_budget(trimmed, max_tokens)
+    return trimmed
+
+
+def compress_prompt(text: str, max_tokens: int = PROMPT_MAX_TOKENS) -> str:
+    text = drop_repeated_blocks(normalize_whitespace(text))
+    if estimate_tokens(text) > max_tokens:
+        text = trim_to_budget(text, max_tokens)
+    return text
+
+
+def preflight(text: str):
+    """
+    Check a prompt before it is sent to the model.
+    Returns (status, prompt, estimated_tokens) where status is "ok", "warn", "compressed" or "reject".
+    """
+    estimated = estimate_tokens(text)
+    if estimated > PROMPT_MAX_TOKENS:
+        if not PROMPT_COMPRESS:
+            return "reject", text, estimated
+        compressed = compress_prompt(text)
+        compressed_tokens = estimate_tokens(compressed)
+        if compressed_tokens > PROMPT_MAX_TOKENS:
+            return "reject", text, estimated
+        return "compressed", compressed, compressed_tokens
+    if estimated > PROMPT_WARN_TOKENS:
+        # Sent as is: pasted code, logs and tables must not be rewritten behind the user's back
+        return "warn", text, estimated
+    return "ok", text, estimated
+
+
+# ========== USAGE TRACKING ==========
+
+_usage_lock = threading.Lock()
+token_usage_by_mode = {}
+
+
+def record_token_usage(mode: str, estimated_tokens: int, usage: dict | None):
+    """Keep running totals of estimated prompt tokens vs the model's reported usage, per mode."""
+    if not usage:
+        return
+    with _usage_lock:
+        stats = token_usage_by_mode.setdefault(mode, {
+            "calls": 0, "estimated_tokens": 0, "input_tokens": 0, "output_tokens": 0
+        })
+        stats["calls"] += 1
+        stats["estimated_tokens"] += estimated_tokens
+        stats["input_tokens"] += usage.get("input_tokens", 0)
+        stats["output_tokens"] += usage.get("output_tokens", 0)
+
+
+def token_usage_report() -> dict:
+    with _usage_lock:
+        report = {}
+        for mode, stats in token_usage_by_mode.items():
+            calls = stats["calls"]
+            report[mode] = {
+                **stats,
+                # Input tokens also cover the system prompt, so this is the per-mode overhead to budget for
+                "avg_estimated_tokens": stats["estimated_tokens"] / calls,
+                "avg_input_tokens": stats["input_tokens"] / calls,
+                "avg_output_tokens": stats["output_tokens"] / calls,
+            }
+        return report
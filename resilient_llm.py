@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+# Per-phase timeouts in seconds
+FIRST_CHUNK_TIMEOUT = 20
+INTER_CHUNK_TIMEOUT = 15
+TOTAL_TIMEOUT = 120
+
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+
+# Hedging: fire a second request if the first chunk is slower than this percentile of recent calls
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 6
+
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "RateLimitError", "APIConnectionError", "ConnectError", "ReadTimeout",
+    "RemoteProtocolError",
+}
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCallError(Exception):
+    """Raised when a streamed call fails for good. `partial` holds whatever text was received."""
+
+    def __init__(self, message, partial=""):
+        super().__init__(message)
+        self.partial = partial
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int, rng=random) -> float:
+    # "Full jitter": uniform between 0 and the capped exponential step
+    return rng.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Rolling window of first-chunk latencies, used to pick the hedging delay."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float, default: float) -> float:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return default
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+# Fed only by hedged calls, so the delay reflects the one call site that hedges
+first_chunk_latencies = LatencyTracker()
+
+
+class ThreadedStream:
+    """Drives a blocking chunk iterator in a worker thread and hands chunks to the event loop."""
+
+    def __init__(self, make_stream, partial: str):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.cancelled = threading.Event()
+        self.usage = None
+        self.thread = threading.Thread(target=self._run, args=(make_stream, partial), daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        # Nobody reads a cancelled stream, and its loop may already be closed
+        if not self.cancelled.is_set():
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def _run(self, make_stream, partial):
+        stream = None
+        try:
+            stream = make_stream(partial)
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    break
+                self._record_usage(getattr(chunk, "usage_metadata", None))
+                self._put(("chunk", chunk.content))
+            self._put(("end", None))
+        except Exception as e:
+            self._put(("error", e))
+        finally:
+            # Closing the generator here, on its own thread, releases the HTTP stream
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+
+    def _record_usage(self, usage):
+        # Providers report usage either once or as per-chunk deltas; summing handles both
+        if not usage:
+            return
+        if self.usage is None:
+            self.usage = {"input_tokens": 0, "output_tokens": 0}
+        for key in self.usage:
+            self.usage[key] += usage.get(key, 0) or 0
+
+    async def next(self, timeout: float):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"No chunk within {timeout:.1f}s") from None
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+async def _first_item(streams: list, timeout: float):
+    """Wait for the first chunk from any stream; return (stream, item) and drop the losers."""
+    waiters = {asyncio.ensure_future(s.queue.get()): s for s in streams}
+    deadline = time.monotonic() + timeout
+    try:
+        while waiters:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for waiter in done:
+                stream = waiters.pop(waiter)
+                item = waiter.result()
+                if item[0] == "error" and waiters:
+                    # The other request may still succeed
+                    stream.cancel()
+                    continue
+                for other in waiters.values():
+                    other.cancel()
+                return stream, item
+        raise LLMTimeoutError(f"No first chunk within {timeout:.1f}s")
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+async def resilient_stream_text(
+    make_stream,
+    *,
+    first_chunk_timeout=FIRST_CHUNK_TIMEOUT,
+    inter_chunk_timeout=INTER_CHUNK_TIMEOUT,
+    total_timeout=TOTAL_TIMEOUT,
+    max_retries=MAX_RETRIES,
+    hedge=False,
+    tracker=first_chunk_latencies,
+    on_usage=None,
+    rng=random,
+) -> str:
+    """
+    Collect the text of a streamed LLM call with timeouts, retries and optional hedging.
+
+    `make_stream(partial)` must return an iterator of chunks with a `.content` attribute. On a
+    retry `partial` is the text received so far, so the callee can ask the model to continue
+    instead of starting over (see the `partial` argument of the prompt_engine functions).
+    `on_usage`, if given, is called with the token usage reported by the stream that completed.
+    Only hedged calls record their first-chunk latency in `tracker`, and only when a chunk came.
+    """
+    text = ""
+    deadline = time.monotonic() + total_timeout
+    attempt = 0
+
+    while True:
+        streams = []
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeoutError(f"Total timeout of {total_timeout}s exceeded")
+
+            started = time.monotonic()
+            primary = ThreadedStream(make_stream, text)
+            streams.append(primary)
+            first_timeout = min(first_chunk_timeout, remaining)
+
+            if hedge and not text:
+                hedge_delay = tracker.percentile(HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY)
+                try:
+                    stream, item = await _first_item([primary], min(hedge_delay, first_timeout))
+                except LLMTimeoutError:
+                    if hedge_delay >= first_timeout:
+                        raise
+                    logger.info("⏱️ First chunk slower than %.1fs, sending hedged request.", hedge_delay)
+                    streams.append(ThreadedStream(make_stream, text))
+                    stream, item = await _first_item(streams, first_timeout - hedge_delay)
+                # An error that arrives first says nothing about how fast the model answers
+                if item[0] != "error":
+                    tracker.record(time.monotonic() - started)
+            else:
+                stream, item = await _first_item([primary], first_timeout)
+
+            while True:
+                kind, value = item
+                if kind == "end":
+                    if on_usage and stream.usage:
+                        on_usage(stream.usage)
+                    return text
+                if kind == "error":
+                    raise value
+                text += value
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMTimeoutError(f"Total timeout of {total_timeout}s exceeded")
+                item = await stream.next(min(inter_chunk_timeout, remaining))
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            out_of_time = deadline - time.monotonic() <= 0
+            if attempt >= max_retries or out_of_time or not is_retryable(e):
+                raise LLMCallError(f"LLM call failed after {attempt + 1} attempt(s): {e}", partial=text) from e
+            delay = min(backoff_delay(attempt, rng), max(0, deadline - time.monotonic()))
+            logger.warning("🔁 Retrying LLM call in %.2fs after: %r", delay, e)
+            attempt += 1
+            await asyncio.sleep(delay)
+        finally:
+            for s in streams:
+                s.cancel()
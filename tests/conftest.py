@@ -0,0 +1,28 @@
+import os
+
+# main.py and prompt_engine.py read these at import time; no real traffic is sent in the tests
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ.setdefault("RUN_MODE", "polling")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+
+import pytest
+
+from tests.fakes import ScriptedChatModel, InMemorySupabase
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    import prompt_engine
+    model = ScriptedChatModel()
+    monkeypatch.setattr(prompt_engine, "model", model)
+    return model
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    import prompt_engine
+    client = InMemorySupabase()
+    monkeypatch.setattr(prompt_engine, "supabase", client)
+    return client
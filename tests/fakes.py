@@ -0,0 +1,234 @@
+"""Offline stand-ins for Gemini, Supabase and the Telegram Bot API, plus a driver for fake chats."""
+import asyncio
+import itertools
+import json
+import time
+
+from langchain_core.messages import AIMessageChunk
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+import main
+
+EXPLANATION_JSON = {
+    "original_prompt": {"strengths": ["Clear topic"], "weaknesses": ["No audience", "No format"]},
+    "llm_understanding_improvements": ["Role is explicit", "Output structure is defined"],
+    "tips_for_future_prompts": ["State the audience", "Ask for a format"],
+}
+OPTIMIZED_TEXT = "You are an expert. " * 50
+FOLLOWUP_TEXT = "1. Scope: global. 2. Depth: expert. 3. Sources: peer reviewed."
+PLAIN_EXPLANATION = "The optimized prompt adds a role, an audience and a format."
+
+
+class ScriptedChatModel:
+    """Stands in for the Gemini chat model: streams canned text in fixed-size chunks."""
+
+    def __init__(self, optimized=OPTIMIZED_TEXT, chunk_size=40, chunk_latency=0.0, explain_as_json=True):
+        self.optimized = optimized
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.explain_as_json = explain_as_json
+        self.calls = []
+
+    def _reply_for(self, messages) -> str:
+        last = messages[-1].content
+        if "valid JSON" in last:
+            if self.explain_as_json:
+                return "```json\n" + json.dumps(EXPLANATION_JSON) + "\n```"
+            return PLAIN_EXPLANATION
+        if "questions" in last:
+            return FOLLOWUP_TEXT
+        return self.optimized
+
+    def stream(self, messages):
+        self.calls.append(messages)
+        text = self._reply_for(messages)
+        for i in range(0, len(text), self.chunk_size):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield AIMessageChunk(content=text[i:i + self.chunk_size])
+
+
+class InMemoryResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class InMemoryTable:
+    def __init__(self, rows, ids):
+        self.rows = rows
+        self.ids = ids
+        self.pending = None
+
+    def insert(self, data):
+        self.pending = data
+        return self
+
+    def execute(self):
+        row = {**self.pending, "id": next(self.ids)}
+        self.rows.append(row)
+        return InMemoryResponse([row])
+
+
+class InMemorySupabase:
+    """Just enough of the Supabase client for the insert calls in prompt_engine."""
+
+    def __init__(self):
+        self.tables = {}
+        self.ids = itertools.count(1)
+
+    def table(self, name):
+        return InMemoryTable(self.tables.setdefault(name, []), self.ids)
+
+    def rows(self, name):
+        return self.tables.get(name, [])
+
+
+class FakeBotRequest(BaseRequest):
+    """Answers Bot API calls locally and records them so tests can assert on what was sent."""
+
+    def __init__(self):
+        self.message_ids = itertools.count(1000)
+        self.calls = []
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((endpoint, params))
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif endpoint in ("sendMessage", "sendDocument", "editMessageReplyMarkup"):
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class BotHarness:
+    """
+    An Application wired to the real conversation handler, the per-chat update processor
+    and a FakeBotRequest. Handler exceptions are collected in `errors` instead of only logged.
+    """
+
+    def __init__(self, max_concurrent_updates=8):
+        self.request = FakeBotRequest()
+        self.application = (
+            ApplicationBuilder()
+            .token(main.TELEGRAM_BOT_TOKEN)
+            .request(self.request)
+            .concurrent_updates(main.ChatOrderedUpdateProcessor(max_concurrent_updates))
+            .build()
+        )
+        self.application.add_handler(main.conv_handler)
+        self.application.add_handler(main.InlineQueryHandler(main.handle_inline_query))
+        self.application.add_error_handler(self._record_error)
+        self.errors = []
+        self.chat_ids = itertools.count(int(time.time() * 1000) % 10**9)
+        self.inline_query_ids = itertools.count(1)
+
+    async def _record_error(self, update, context):
+        self.errors.append(context.error)
+
+    async def __aenter__(self):
+        await self.application.initialize()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.application.shutdown()
+
+    def chat(self):
+        return ChatDriver(self, next(self.chat_ids))
+
+    async def inline_query(self, user_id: int, query: str) -> str:
+        """Send an inline query (they carry no chat); returns its id to match answerInlineQuery calls."""
+        query_id = str(next(self.inline_query_ids))
+        update = Update.de_json({"update_id": next(self.inline_query_ids), "inline_query": {
+            "id": query_id, "from": {**USER, "id": user_id}, "query": query, "offset": "",
+        }}, self.application.bot)
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        return query_id
+
+    def inline_answers(self) -> list[dict]:
+        return [params for name, params in self.request.calls if name == "answerInlineQuery"]
+
+
+USER = {"is_bot": False, "first_name": "Bench"}
+
+
+class ChatDriver:
+    """Builds raw updates for one private chat and feeds them through the update processor."""
+
+    def __init__(self, harness: BotHarness, chat_id: int):
+        self.harness = harness
+        self.application = harness.application
+        self.chat_id = chat_id
+        self.chat = {"id": chat_id, "type": "private"}
+        self.ids = itertools.count(1)
+
+    def _message(self, text):
+        message = {"message_id": next(self.ids), "date": int(time.time()), "chat": self.chat,
+                   "from": {**USER, "id": self.chat_id}, "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return message
+
+    async def _dispatch(self, data):
+        update = Update.de_json(data, self.application.bot)
+        processor = self.application.update_processor
+        await processor.process_update(update, self.application.process_update(update))
+
+    async def send(self, text):
+        await self._dispatch({"update_id": next(self.ids), "message": self._message(text)})
+
+    async def press(self, callback_data):
+        bot_message = {"message_id": next(self.ids), "date": int(time.time()), "chat": self.chat,
+                       "from": {"id": 1, "is_bot": True, "first_name": "Benchmark"}, "text": "..."}
+        await self._dispatch({"update_id": next(self.ids), "callback_query": {
+            "id": str(next(self.ids)), "from": {**USER, "id": self.chat_id},
+            "chat_instance": "benchmark", "data": callback_data, "message": bot_message,
+        }})
+
+    def send_in_background(self, text) -> asyncio.Task:
+        return asyncio.create_task(self.send(text))
+
+    def press_in_background(self, callback_data) -> asyncio.Task:
+        return asyncio.create_task(self.press(callback_data))
+
+    @property
+    def state(self):
+        """The ConversationHandler state for this chat, or None when no conversation is running."""
+        return main.conv_handler._conversations.get((self.chat_id, self.chat_id))
+
+    def calls(self, endpoint=None):
+        return [
+            (name, params) for name, params in self.harness.request.calls
+            if str(params.get("chat_id")) == str(self.chat_id) and (endpoint is None or name == endpoint)
+        ]
+
+    def replies(self) -> list[str]:
+        return [params["text"] for _, params in self.calls("sendMessage")]
+
+    def take_replies(self) -> list[str]:
+        """Replies sent since the last call, so each step can be checked on its own."""
+        replies = self.replies()
+        seen = getattr(self, "_seen", 0)
+        self._seen = len(replies)
+        return replies[seen:]
@@ -0,0 +1,235 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+import main
+from mode_registry import ModeSnapshot
+from postprocess import format_explanation_to_messages
+from tests.fakes import BotHarness, EXPLANATION_JSON, FOLLOWUP_TEXT, OPTIMIZED_TEXT, PLAIN_EXPLANATION
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def harness(fake_model, fake_supabase):
+    async with BotHarness() as harness:
+        yield harness
+    assert harness.errors == [], f"handlers raised: {harness.errors!r}"
+
+
+def keyboard_data(params) -> list[str]:
+    return [button["callback_data"] for row in params["reply_markup"]["inline_keyboard"] for button in row]
+
+
+async def test_normal_conversation_with_explanation(harness, fake_supabase):
+    chat = harness.chat()
+
+    await chat.send("/start")
+    assert chat.take_replies() == ["👋 Welcome! Please send your raw prompt."]
+    assert chat.state == main.ASK_PROMPT
+
+    await chat.send("how do vaccines work")
+    assert chat.take_replies() == ["🔧 Choose the mode:"]
+    assert "mode:clarity" in keyboard_data(chat.calls("sendMessage")[-1][1])
+    assert chat.state == main.ASK_MODE
+
+    await chat.press("mode:clarity")
+    assert chat.take_replies() == [
+        "⚙️ Optimizing your prompt...", OPTIMIZED_TEXT, "📘 Want explanation of the optimization?"
+    ]
+    assert keyboard_data(chat.calls("sendMessage")[-1][1]) == ["explain:yes", "explain:no"]
+    assert chat.state == main.ASK_EXPLAIN
+    [row] = fake_supabase.rows("optimized_prompts")
+    assert row["mode"] == "clarity" and row["original_prompt"] == "how do vaccines work"
+
+    await chat.press("explain:yes")
+    assert chat.take_replies() == format_explanation_to_messages(EXPLANATION_JSON)
+    assert chat.state is None
+    [explanation] = fake_supabase.rows("prompt_explanations")
+    assert explanation["prompt_id"] == row["id"]
+    # answerCallbackQuery carries no chat_id, and this harness only served this chat
+    assert [name for name, _ in harness.request.calls].count("answerCallbackQuery") == 2
+
+
+async def test_explanation_without_json_is_sent_as_text(harness, fake_model, fake_supabase):
+    fake_model.explain_as_json = False
+    chat = harness.chat()
+
+    await chat.send("/start")
+    await chat.send("how do vaccines work")
+    await chat.press("mode:clarity")
+    chat.take_replies()
+
+    await chat.press("explain:yes")
+    assert chat.take_replies() == [PLAIN_EXPLANATION]
+    assert chat.state is None
+    assert fake_supabase.rows("prompt_explanations") == []
+
+
+async def test_one_shot_optimize_command(harness, fake_model):
+    chat = harness.chat()
+
+    await chat.send("/optimize concise explain black holes to a child")
+    assert chat.take_replies() == [
+        "⚙️ Optimizing your prompt...", OPTIMIZED_TEXT, "📘 Want explanation of the optimization?"
+    ]
+    assert chat.state == main.ASK_EXPLAIN
+    assert "explain black holes to a child" in fake_model.calls[-1][-1].content
+
+    await chat.press("explain:no")
+    assert chat.take_replies() == [
+        "✅ Done. You can send another prompt with /start or /optimize <mode> <prompt>."
+    ]
+    assert chat.state is None
+
+
+async def test_optimize_command_mode_is_case_insensitive_and_keeps_newlines(harness, fake_model, fake_supabase):
+    chat = harness.chat()
+
+    await chat.send("/optimize Concise explain black holes\n- to a child\n- in 3 bullets")
+    assert chat.state == main.ASK_EXPLAIN
+    [row] = fake_supabase.rows("optimized_prompts")
+    assert row["mode"] == "concise"
+    assert row["original_prompt"] == "explain black holes\n- to a child\n- in 3 bullets"
+    assert fake_model.calls[-1][-1].content.endswith("explain black holes\n- to a child\n- in 3 bullets")
+
+
+async def test_optimize_command_without_mode_asks_for_it(harness):
+    chat = harness.chat()
+
+    await chat.send("/optimize explain black holes")
+    assert chat.take_replies() == ["🔧 Choose the mode:"]
+    assert chat.state == main.ASK_MODE
+
+
+async def test_deep_research_with_followup(harness, fake_model, fake_supabase):
+    chat = harness.chat()
+
+    await chat.send("/start")
+    await chat.send("history of the indian stock market")
+    await chat.press("mode:deep_research")
+    assert chat.take_replies()[-1] == "🤔 Want to answer follow-up questions?"
+    assert keyboard_data(chat.calls("sendMessage")[-1][1]) == ["followup:yes", "followup:no"]
+    assert chat.state == main.ASK_FOLLOWUP
+
+    await chat.press("followup:yes")
+    assert chat.take_replies() == ["✍️ Please enter the questions asked by the model:"]
+    assert chat.state == main.ASK_FOLLOWUP + 10
+
+    await chat.send("What time period? Which exchanges?")
+    assert chat.take_replies() == ["💬 Any preferences/answers to the questions? (or type 'no')"]
+    assert chat.state == main.ASK_FOLLOWUP + 11
+
+    await chat.send("no")
+    assert chat.take_replies() == [FOLLOWUP_TEXT, "📘 Want explanation of the optimization?"]
+    assert chat.state == main.ASK_EXPLAIN
+    [saved] = fake_supabase.rows("deep_research_questions")
+    assert saved["questions_asked"] == "What time period? Which exchanges?"
+    assert saved["preferences"] == ""
+
+    await chat.press("explain:yes")
+    assert chat.take_replies() == format_explanation_to_messages(EXPLANATION_JSON)
+    assert chat.state is None
+
+
+async def test_deep_research_without_followup(harness):
+    chat = harness.chat()
+
+    await chat.send("/optimize deep_research history of the indian stock market")
+    chat.take_replies()
+
+    await chat.press("followup:no")
+    assert chat.take_replies() == ["📘 Want explanation of the optimization?"]
+    assert chat.state == main.ASK_EXPLAIN
+
+
+async def test_stale_mode_page_is_clamped(harness):
+    chat = harness.chat()
+
+    await chat.send("/optimize explain black holes")
+    await chat.press("mode_page:99")
+    [(_, params)] = chat.calls("editMessageReplyMarkup")
+    assert params["reply_markup"] == main.MODE_KEYBOARDS[-1].to_dict()
+    assert chat.state == main.ASK_MODE
+
+
+async def test_unknown_mode_is_asked_again(harness):
+    chat = harness.chat()
+
+    await chat.send("/start")
+    await chat.send("how do vaccines work")
+    chat.take_replies()
+
+    await chat.press("mode:nonexistent")
+    assert chat.take_replies() == ["❓ Unknown mode 'nonexistent'. Please pick one:"]
+    assert chat.state == main.ASK_MODE
+
+
+async def test_cancel_ends_the_conversation(harness):
+    chat = harness.chat()
+
+    await chat.send("/start")
+    await chat.send("/cancel")
+    assert chat.take_replies()[-1] == "❌ Canceled."
+    assert chat.state is None
+
+
+async def test_cancel_aborts_a_running_optimization(harness, fake_model):
+    fake_model.chunk_latency = 0.05  # ~1.5s for the whole answer
+    chat = harness.chat()
+    await chat.send("/start")
+    await chat.send("how do vaccines work")
+    chat.take_replies()
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    optimizing = chat.press_in_background("mode:clarity")
+    await asyncio.sleep(0.2)
+    await chat.send("/cancel")
+    assert chat.state is None
+    await optimizing
+
+    assert loop.time() - started < 1
+    assert chat.take_replies() == ["⚙️ Optimizing your prompt...", "❌ Canceled."]
+    assert chat.state is None
+
+
+async def test_cancel_aborts_a_running_explanation(harness, fake_model):
+    chat = harness.chat()
+    await chat.send("/optimize clarity how do vaccines work")
+    chat.take_replies()
+
+    fake_model.chunk_latency = 0.05
+    explaining = chat.press_in_background("explain:yes")
+    await asyncio.sleep(0.2)
+    await chat.send("/cancel")
+    await explaining
+
+    assert chat.take_replies() == ["❌ Canceled."]
+    assert chat.state is None
+
+
+async def test_reload_during_generation_logs_the_version_used(harness, fake_model, fake_supabase):
+    registry = main.mode_registry
+    original = registry.snapshot
+    reloaded = ModeSnapshot(
+        1, {**original.instructions, "clarity": "Reloaded clarity goal"}, {**original.versions, "clarity": 1}, "etag"
+    )
+    fake_model.chunk_latency = 0.02
+    chat = harness.chat()
+    await chat.send("/start")
+    await chat.send("how do vaccines work")
+
+    try:
+        optimizing = chat.press_in_background("mode:clarity")
+        await asyncio.sleep(0.1)
+        registry.apply(reloaded)
+        await optimizing
+    finally:
+        registry.apply(original)
+
+    [row] = fake_supabase.rows("optimized_prompts")
+    assert row["mode_version"] == original.versions["clarity"]
+    system_prompt = fake_model.calls[-1][0].content
+    assert original.instructions["clarity"] in system_prompt
@@ -0,0 +1,119 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import evaluate
+import prompt_engine
+from evaluate import Variant, judge, judge_score, summarize
+from postprocess import extract_json_from_response
+from tests.fakes import ScriptedChatModel
+
+ANALYSIS = {"optimized_prompt_score": 8, "original_prompt": {"strengths": [], "weaknesses": ["vague"]}}
+
+
+@pytest.mark.parametrize("response", [
+    json.dumps(ANALYSIS),
+    "```json\n" + json.dumps(ANALYSIS) + "\n```",
+    "Here is the analysis:\n" + json.dumps(ANALYSIS, indent=2) + "\nHope this helps!",
+], ids=["plain", "fenced", "surrounded"])
+def test_extract_json_accepts_plain_and_fenced(response):
+    assert extract_json_from_response(response) == ANALYSIS
+
+
+@pytest.mark.parametrize("response", ["no json here", "{not valid json}", ""])
+def test_extract_json_returns_none_without_json(response):
+    assert extract_json_from_response(response) is None
+
+
+@pytest.mark.parametrize("response, expected", [
+    (json.dumps(ANALYSIS), 0.8),
+    (json.dumps({**ANALYSIS, "optimized_prompt_score": "3"}), 0.3),
+    (json.dumps({**ANALYSIS, "optimized_prompt_score": 42}), 1.0),
+    (json.dumps({"original_prompt": {}}), None),
+    ("not json", None),
+    ("[1, 2]", None),
+])
+def test_judge_score_reads_the_explicit_rating(response, expected):
+    assert judge_score(response) == expected
+
+
+class RecordingJudge:
+    def __init__(self, score):
+        self.score = score
+        self.requests = []
+
+    def stream(self, messages):
+        self.requests.append(messages[-1].content)
+        if isinstance(self.score, Exception):
+            raise self.score
+        yield SimpleNamespace(content=json.dumps({**ANALYSIS, "optimized_prompt_score": self.score}),
+                              usage_metadata=None)
+
+
+@pytest.mark.asyncio
+async def test_judge_uses_the_variants_own_goal():
+    goal = "Rewrite the prompt as a limerick."
+    variant = Variant({"name": "limerick", "modes": {"clarity": goal}})
+    llm = RecordingJudge(score=9)
+    cache = {}
+
+    score = await judge(variant, {"prompt": "explain tides", "mode": "clarity"}, "There once was a tide...",
+                        llm, "judge-model", cache, asyncio.Semaphore(1))
+    assert score == 0.9
+    assert goal in llm.requests[0]
+    assert "optimized_prompt_score" in llm.requests[0]
+
+    baseline = Variant({"name": "baseline"})
+    await judge(baseline, {"prompt": "explain tides", "mode": "clarity"}, "There once was a tide...",
+                llm, "judge-model", cache, asyncio.Semaphore(1))
+    assert len(llm.requests) == 2, "a different goal must not reuse the cached judgement"
+    assert goal not in llm.requests[1]
+    assert evaluate.mode_registry.modes["clarity"] in llm.requests[1]
+
+
+@pytest.mark.asyncio
+async def test_failed_judgements_are_none_and_not_cached():
+    variant = Variant({"name": "baseline"})
+    item = {"prompt": "explain tides", "mode": "clarity"}
+    cache = {}
+
+    for llm in (RecordingJudge(score=ValueError("invalid argument")), RecordingJudge(score=None)):
+        assert await judge(variant, item, "Tides are...", llm, "judge-model", cache, asyncio.Semaphore(1)) is None
+    assert cache == {}
+
+
+def test_summary_leaves_failed_judgements_out_of_the_mean():
+    variant = Variant({"name": "baseline"})
+    rows = [
+        {"variant": variant, "latency": 1.0, "input_tokens": 1, "output_tokens": 1, "cached": False,
+         "heuristic": 0.5, "judge": judge}
+        for judge in (0.8, 0.6, None)
+    ]
+    [report] = summarize([variant], rows).values()
+    assert report["judge"] == 0.7
+    assert report["judge_failed"] == 1
+
+    [empty] = summarize([variant], []).values()
+    assert empty["items"] == 0 and empty["heuristic"] is None and empty["judge"] is None
+
+
+@pytest.mark.asyncio
+async def test_second_run_is_served_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluate, "CACHE_FILE", str(tmp_path / "eval_cache.json"))
+    judge_llm = RecordingJudge(score=7)
+    monkeypatch.setattr(prompt_engine, "model", judge_llm)
+    variant = Variant({"name": "fake"})
+    variant.llm = ScriptedChatModel(optimized="You are a tutor. Explain tides to a beginner in bullets.")
+    corpus = evaluate.DEFAULT_CORPUS[:2]
+
+    first = await evaluate.evaluate([variant], corpus, llm_judge=True, concurrency=2)
+    assert len(variant.llm.calls) == len(corpus) and len(judge_llm.requests) == len(corpus)
+    assert first["fake"]["cached"] == 0 and first["fake"]["judge"] == 0.7
+
+    second = await evaluate.evaluate([variant], corpus, llm_judge=True, concurrency=2)
+    assert len(variant.llm.calls) == len(corpus) and len(judge_llm.requests) == len(corpus)
+    assert second["fake"]["cached"] == len(corpus)
+    assert {k: v for k, v in second["fake"].items() if not k.startswith(("cached", "latency"))} == \
+        {k: v for k, v in first["fake"].items() if not k.startswith(("cached", "latency"))}
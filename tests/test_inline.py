@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import pytest
+import pytest_asyncio
+
+import main
+import prompt_engine
+from tests.fakes import BotHarness, OPTIMIZED_TEXT, ScriptedChatModel
+
+pytestmark = pytest.mark.asyncio
+
+USER_ID = 4242
+
+
+@pytest.fixture(autouse=True)
+def fast_inline(monkeypatch):
+    monkeypatch.setattr(main, "INLINE_DEBOUNCE_SECONDS", 0.05)
+    monkeypatch.setattr(main, "INLINE_ANSWER_TIMEOUT", 0.5)
+    monkeypatch.setattr(main, "inline_result_cache", OrderedDict())
+    monkeypatch.setattr(main, "inline_generation_slots", asyncio.Semaphore(main.INLINE_MAX_GENERATIONS))
+
+
+@pytest_asyncio.fixture
+async def harness(fake_model):
+    async with BotHarness() as harness:
+        yield harness
+    assert harness.errors == [], f"handlers raised: {harness.errors!r}"
+
+
+async def settle():
+    """Wait for every debounced inline answer to finish."""
+    while main.inline_tasks:
+        await asyncio.gather(*main.inline_tasks.values(), return_exceptions=True)
+
+
+def result_ids(answer) -> list[str]:
+    return [result["id"] for result in answer["results"]]
+
+
+def optimized_texts(model) -> list[str]:
+    return [messages[-1].content for messages in model.calls]
+
+
+async def test_typing_is_debounced_into_one_answer_then_cached(harness, fake_model):
+    query_ids = [await harness.inline_query(USER_ID, query) for query in ("h", "he", "hello")]
+    await settle()
+
+    # "h" and "he" were cancelled while debouncing, so only "hello" reached the model
+    assert optimized_texts(fake_model) == ["Optimise this: hello"] * len(main.INLINE_MODES)
+    [answer] = harness.inline_answers()
+    assert answer["inline_query_id"] == query_ids[-1]
+    assert result_ids(answer) == list(main.INLINE_MODES)
+    assert answer["results"][0]["input_message_content"]["message_text"] == OPTIMIZED_TEXT
+    assert answer["cache_time"] == main.INLINE_CACHE_TIME
+
+    # The same text again is answered from the cache, right away and without the model
+    await harness.inline_query(USER_ID, "hello")
+    assert len(fake_model.calls) == len(main.INLINE_MODES)
+    assert len(harness.inline_answers()) == 2
+    assert harness.inline_answers()[1]["cache_time"] == main.INLINE_CACHE_TIME
+    assert main.inline_tasks == {}
+
+
+async def test_slow_modes_give_a_partial_uncached_answer(harness, monkeypatch):
+    slow_goal = main.mode_registry.modes["structured"]
+
+    class SlowStructured(ScriptedChatModel):
+        def stream(self, messages):
+            if slow_goal in messages[0].content:
+                time.sleep(2)
+            yield from super().stream(messages)
+
+    monkeypatch.setattr(prompt_engine, "model", SlowStructured())
+    started = time.monotonic()
+    await harness.inline_query(USER_ID, "explain tides")
+    await settle()
+
+    assert time.monotonic() - started < 1.5
+    [answer] = harness.inline_answers()
+    assert result_ids(answer) == ["clarity", "concise"]
+    assert answer["cache_time"] == 0
+    # Only the finished modes are cached, so the next identical query regenerates just the slow one
+    assert main.cached_inline_results("explain tides").keys() == {"clarity", "concise"}
+
+
+async def test_inline_generations_share_a_global_limit(harness, monkeypatch):
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    class CountingModel(ScriptedChatModel):
+        def stream(self, messages):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            try:
+                time.sleep(0.05)
+                yield from super().stream(messages)
+            finally:
+                with lock:
+                    active -= 1
+
+    monkeypatch.setattr(prompt_engine, "model", CountingModel())
+    monkeypatch.setattr(main, "inline_generation_slots", asyncio.Semaphore(2))
+    monkeypatch.setattr(main, "INLINE_ANSWER_TIMEOUT", 5)
+
+    for user_id in range(1, 4):
+        await harness.inline_query(user_id, f"query from user {user_id}")
+    await settle()
+
+    assert peak == 2
+    answers = harness.inline_answers()
+    assert len(answers) == 3
+    assert all(answer["cache_time"] == main.INLINE_CACHE_TIME for answer in answers)
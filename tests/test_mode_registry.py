@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+import main
+import prompt_engine
+from mode_registry import ModeRegistry, ModeSnapshot, parse_modes_document
+
+DEFAULTS = {"clarity": "Be clear.", "concise": "Be brief."}
+
+
+def test_parse_modes_document_bare_strings_and_objects():
+    snapshot = parse_modes_document({"version": 3, "modes": {
+        "clarity": "Be very clear.",
+        "concise": {"instruction": "Be very brief.", "version": 7},
+        "teaching": {"instruction": "Teach it."},
+    }}, etag="e")
+    assert snapshot.version == 3
+    assert snapshot.instructions == {"clarity": "Be very clear.", "concise": "Be very brief.", "teaching": "Teach it."}
+    # A bare string, or an object without a version, takes the file version
+    assert snapshot.versions == {"clarity": 3, "concise": 7, "teaching": 3}
+    assert snapshot.etag == "e"
+
+
+def write_modes(path, document, mtime):
+    path.write_text(json.dumps(document), encoding="utf-8")
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_file_source_only_reparses_when_mtime_or_size_changes(tmp_path):
+    path = tmp_path / "modes.json"
+    write_modes(path, {"version": 1, "modes": {"clarity": "Be very clear."}}, mtime=10**18)
+    registry = ModeRegistry(DEFAULTS, source="file", path=str(path))
+
+    assert registry.reload() == {"clarity", "concise"}
+    assert registry.modes == {"clarity": "Be very clear."}
+    assert registry.fetch() is None
+
+    # Same size and mtime: treated as unchanged without reading the file
+    write_modes(path, {"version": 1, "modes": {"clarity": "Be very CLEAR."}}, mtime=10**18)
+    assert registry.fetch() is None
+
+    write_modes(path, {"version": 2, "modes": {"clarity": "Be very CLEAR."}}, mtime=10**18 + 1)
+    assert registry.reload() == {"clarity"}
+    assert registry.snapshot.versions == {"clarity": 2}
+
+
+class FakeModesTable:
+    def __init__(self, rows):
+        self.rows = rows
+        self.selects = 0
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        self.selects += 1
+        return self
+
+    def execute(self):
+        return type("Response", (), {"data": list(self.rows)})()
+
+
+def test_supabase_source_reloads_only_when_a_version_changes():
+    client = FakeModesTable([
+        {"name": "clarity", "instruction": "Be very clear.", "version": 4},
+        {"name": "concise", "instruction": "Be brief.", "version": 2},
+    ])
+    registry = ModeRegistry(DEFAULTS, source="supabase", client=client)
+
+    assert registry.reload() == {"clarity", "concise"}
+    assert registry.snapshot.version == 4
+
+    # Instruction edited without bumping the version: the etag is unchanged, so nothing reloads
+    client.rows[0] = {**client.rows[0], "instruction": "Edited."}
+    assert registry.fetch() is None
+
+    client.rows[0] = {**client.rows[0], "version": 5}
+    assert registry.reload() == {"clarity"}
+    assert registry.modes["clarity"] == "Edited."
+
+
+def test_empty_source_is_reported_once(capsys):
+    client = FakeModesTable([])
+    registry = ModeRegistry(DEFAULTS, source="supabase", client=client)
+
+    assert registry.reload() == set()
+    assert registry.reload() == set()
+    assert registry.modes == DEFAULTS
+    assert capsys.readouterr().out.count("Ignoring empty mode registry") == 1
+
+
+@pytest.fixture
+def live_registry():
+    registry = prompt_engine.mode_registry
+    original = registry.snapshot
+    yield registry
+    registry.apply(original)
+
+
+def test_apply_invalidates_caches_for_changed_modes_only(live_registry, monkeypatch):
+    monkeypatch.setattr(main, "inline_result_cache", main.OrderedDict())
+    original = live_registry.snapshot
+    for mode in ("clarity", "concise"):
+        prompt_engine.system_prompt_for(mode)
+        main.inline_result_cache[main.inline_cache_key(mode, "hello")] = f"{mode} answer"
+
+    changed = live_registry.apply(ModeSnapshot(
+        original.version + 1,
+        {**original.instructions, "clarity": "Reloaded clarity goal"},
+        {**original.versions, "clarity": original.versions["clarity"] + 1},
+        "etag",
+    ))
+
+    assert changed == {"clarity"}
+    assert {mode for mode, _ in prompt_engine._system_prompt_cache} >= {"concise"}
+    assert not any(mode == "clarity" for mode, _ in prompt_engine._system_prompt_cache)
+    assert main.cached_inline_results("hello") == {"concise": "concise answer"}
+    assert "Reloaded clarity goal" in prompt_engine.system_prompt_for("clarity").content
+    assert main.MODE_KEYBOARDS == main.build_mode_keyboards(live_registry.modes)
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import postprocess
+from postprocess import postprocess_report, run_postprocess
+
+pytestmark = pytest.mark.asyncio
+
+LIMIT = 100
+
+
+@pytest.fixture(autouse=True)
+def single_worker_pool(monkeypatch):
+    """A one-thread pool and fresh metrics per test, so queueing is predictable and counts start at zero."""
+    monkeypatch.setattr(postprocess, "POSTPROCESS_INLINE_CHARS", LIMIT)
+    monkeypatch.setattr(postprocess, "POSTPROCESS_WORKERS", 1)
+    monkeypatch.setattr(postprocess, "POSTPROCESS_EXECUTOR", "thread")
+    monkeypatch.setattr(postprocess, "postprocess_metrics", dict.fromkeys(postprocess.postprocess_metrics, 0))
+    postprocess.shutdown_postprocess()
+    yield
+    postprocess.shutdown_postprocess()
+
+
+def current_thread_name(*_):
+    return threading.current_thread().name
+
+
+async def test_small_outputs_run_inline_and_large_ones_in_the_pool():
+    assert await run_postprocess(current_thread_name, size=LIMIT - 1) == threading.current_thread().name
+    assert (await run_postprocess(current_thread_name, size=LIMIT)).startswith("postprocess")
+
+    report = postprocess_report()
+    assert report["inline"] == 1 and report["offloaded"] == 1
+    assert report["cancelled"] == 0
+
+
+async def test_cancelling_the_caller_drops_a_queued_job():
+    gate = threading.Event()
+    ran = []
+    try:
+        busy = asyncio.create_task(run_postprocess(gate.wait, 5, size=LIMIT))
+        queued = asyncio.create_task(run_postprocess(ran.append, "queued", size=LIMIT))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+    finally:
+        gate.set()
+    assert await busy is True
+
+    assert ran == []
+    report = postprocess_report()
+    assert report["cancelled"] == 1 and report["offloaded"] == 1
+
+
+async def test_queue_wait_is_measured_behind_a_busy_worker():
+    first, second = await asyncio.gather(
+        run_postprocess(time.sleep, 0.2, size=LIMIT),
+        run_postprocess(current_thread_name, size=LIMIT),
+    )
+    assert first is None and second.startswith("postprocess")
+
+    report = postprocess_report()
+    assert report["offloaded"] == 2
+    # The first job starts right away; the second waits for the whole of the first
+    assert 0.15 <= report["queue_wait_max"] <= report["queue_wait_total"]
+    assert report["queue_wait_avg"] == pytest.approx(report["queue_wait_total"] / 2)
@@ -0,0 +1,75 @@
+import pytest
+
+import prompt_guard
+from prompt_guard import PROMPT_MAX_TOKENS, cut_to_budget, estimate_tokens, preflight, trim_to_budget
+
+MINIFIED_JSON = '{"k":[1,2],"v":"x"},' * 5000
+SHORT_WORDS = "a " * 20000
+PROSE = "The market opened higher today. " * 2000
+
+
+@pytest.mark.parametrize("text", [MINIFIED_JSON, SHORT_WORDS, PROSE], ids=["json", "short_words", "prose"])
+def test_compressed_prompt_fits_the_limit(text):
+    status, prompt, estimated = preflight(text)
+    assert status == "compressed"
+    assert estimated == estimate_tokens(prompt) <= PROMPT_MAX_TOKENS
+
+
+@pytest.mark.parametrize("text", [MINIFIED_JSON, SHORT_WORDS], ids=["json", "short_words"])
+def test_cut_to_budget_keeps_the_longest_fitting_prefix(text):
+    cut = cut_to_budget(text, 1000)
+    assert estimate_tokens(cut) <= 1000
+    assert estimate_tokens(text[:len(cut) + 1]) > 1000
+    assert text.startswith(cut)
+
+
+def test_trim_keeps_start_and_end():
+    text = " ".join(f"Sentence number {i}." for i in range(2000))
+    trimmed = trim_to_budget(text, 500)
+    assert estimate_tokens(trimmed) <= 500
+    assert trimmed.startswith("Sentence number 0.")
+    assert trimmed.endswith("Sentence number 1999.")
+    assert prompt_guard.TRIM_MARKER in trimmed
+
+
+def test_prompt_still_over_the_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(prompt_guard, "compress_prompt", lambda text: text)
+    status, prompt, estimated = preflight(PROSE)
+    assert status == "reject"
+    assert estimated > PROMPT_MAX_TOKENS
+
+
+def test_reject_without_compression(monkeypatch):
+    monkeypatch.setattr(prompt_guard, "PROMPT_COMPRESS", False)
+    assert preflight(PROSE)[0] == "reject"
+
+
+def test_small_prompts_pass_unchanged():
+    assert preflight("how do vaccines work") == ("ok", "how do vaccines work", estimate_tokens("how do vaccines work"))
+    assert preflight("word " * 3000)[:2] == ("warn", "word " * 3000)
+
+
+CODE_FUNCTION = """\
+def handler_{i}(x):
+    if x is None:
+        return compute_value(x, option=True)
+    for item in x:
+        print(  item  )   \n\n\n
+    return compute_value(x, option=True)
+"""
+
+
+def test_code_in_the_warn_tier_comes_back_byte_for_byte():
+    code = "".join(CODE_FUNCTION.format(i=i) for i in range(60))
+    status, prompt, _ = preflight(code)
+    assert status == "warn"
+    assert prompt == code
+
+
+def test_compression_keeps_leading_indentation():
+    code = "".join(CODE_FUNCTION.format(i=i) for i in range(600))
+    status, prompt, estimated = preflight(code)
+    assert status == "compressed" and estimated <= PROMPT_MAX_TOKENS
+    assert "def handler_0(x):\n    if x is None:\n        return compute_value(x, option=True)" in prompt
+    assert "\n    for item in x:\n" in prompt
+    assert "   \n" not in prompt and "\n\n\n" not in prompt
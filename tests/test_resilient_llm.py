@@ -0,0 +1,170 @@
+import asyncio
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import resilient_llm
+from resilient_llm import LatencyTracker, LLMCallError, LLMTimeoutError, resilient_stream_text
+
+pytestmark = pytest.mark.asyncio
+
+SHORT = 0.05
+
+
+class ScriptedCalls:
+    """
+    `make_stream` stand-in: the n-th call plays the n-th script. A script step is a chunk of
+    text, an exception to raise, or a threading.Event to block on (a stalled connection).
+    """
+
+    def __init__(self, *scripts):
+        self.scripts = list(scripts)
+        self.partials = []
+        self.closed = []
+
+    def __call__(self, partial):
+        index = len(self.partials)
+        self.partials.append(partial)
+        return self._play(index, self.scripts[index])
+
+    def _play(self, index, script):
+        try:
+            for step in script:
+                if isinstance(step, BaseException):
+                    raise step
+                if isinstance(step, threading.Event):
+                    step.wait(5)
+                    continue
+                yield SimpleNamespace(content=step, usage_metadata=None)
+        finally:
+            self.closed.append(index)
+
+
+@pytest.fixture
+def stall():
+    """An event the scripted streams block on; released at teardown so no worker thread lingers."""
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(resilient_llm, "BACKOFF_BASE", 0.01)
+
+
+def rng():
+    return random.Random(1234)
+
+
+async def test_first_chunk_timeout(stall):
+    calls = ScriptedCalls([stall, "late"])
+    with pytest.raises(LLMCallError) as raised:
+        await resilient_stream_text(calls, first_chunk_timeout=SHORT, max_retries=0, rng=rng())
+    assert isinstance(raised.value.__cause__, LLMTimeoutError)
+    assert raised.value.partial == ""
+    assert len(calls.partials) == 1
+
+
+async def test_inter_chunk_timeout(stall):
+    calls = ScriptedCalls(["Hello ", stall, "world"])
+    with pytest.raises(LLMCallError) as raised:
+        await resilient_stream_text(calls, inter_chunk_timeout=SHORT, max_retries=0, rng=rng())
+    assert isinstance(raised.value.__cause__, LLMTimeoutError)
+    assert raised.value.partial == "Hello "
+
+
+async def test_total_timeout_is_not_retried(stall):
+    calls = ScriptedCalls(["Hello ", stall, "world"], ["never used"])
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with pytest.raises(LLMCallError) as raised:
+        await resilient_stream_text(
+            calls, first_chunk_timeout=5, inter_chunk_timeout=5, total_timeout=SHORT, max_retries=2, rng=rng()
+        )
+    assert loop.time() - started < 1
+    assert raised.value.partial == "Hello "
+    assert len(calls.partials) == 1
+
+
+async def test_retry_on_retryable_error(caplog):
+    calls = ScriptedCalls([ConnectionError("reset by peer")], ["Hello"])
+    assert await resilient_stream_text(calls, rng=rng()) == "Hello"
+    assert calls.partials == ["", ""]
+    expected_delay = resilient_llm.backoff_delay(0, rng())
+    assert f"Retrying LLM call in {expected_delay:.2f}s" in caplog.text
+
+
+async def test_no_retry_on_non_retryable_error():
+    calls = ScriptedCalls([ValueError("invalid argument")], ["never used"])
+    with pytest.raises(LLMCallError) as raised:
+        await resilient_stream_text(calls, rng=rng())
+    assert isinstance(raised.value.__cause__, ValueError)
+    assert len(calls.partials) == 1
+
+
+async def test_retry_continues_from_partial_text():
+    calls = ScriptedCalls(["Hello ", ConnectionError("reset by peer")], ["world"])
+    assert await resilient_stream_text(calls, rng=rng()) == "Hello world"
+    assert calls.partials == ["", "Hello "]
+
+
+async def test_final_failure_carries_partial_text():
+    calls = ScriptedCalls(
+        ["Hello ", ConnectionError("reset by peer")],
+        ["big ", ConnectionError("reset by peer")],
+    )
+    with pytest.raises(LLMCallError) as raised:
+        await resilient_stream_text(calls, max_retries=1, rng=rng())
+    assert raised.value.partial == "Hello big "
+    assert calls.partials == ["", "Hello "]
+
+
+async def test_usage_is_reported_for_the_completed_stream():
+    def make_stream(partial):
+        yield SimpleNamespace(content="Hel", usage_metadata={"input_tokens": 10, "output_tokens": 1})
+        yield SimpleNamespace(content="lo", usage_metadata={"input_tokens": 0, "output_tokens": 2})
+
+    usage = []
+    assert await resilient_stream_text(make_stream, on_usage=usage.append, rng=rng()) == "Hello"
+    assert usage == [{"input_tokens": 10, "output_tokens": 3}]
+
+
+async def test_hedged_request_wins_and_slow_one_is_cancelled(stall):
+    tracker = LatencyTracker()
+    for _ in range(resilient_llm.HEDGE_MIN_SAMPLES):
+        tracker.record(SHORT)
+    calls = ScriptedCalls([stall, "slow ", "answer"], ["fast ", "answer"])
+
+    result = await resilient_stream_text(calls, hedge=True, tracker=tracker, first_chunk_timeout=5, rng=rng())
+    assert result == "fast answer"
+    assert calls.partials == ["", ""]
+
+    # The slow stream notices the cancellation on its next chunk and closes its generator
+    stall.set()
+    for _ in range(100):
+        if 0 in calls.closed:
+            break
+        await asyncio.sleep(0.01)
+    assert 0 in calls.closed
+
+
+async def test_only_hedged_calls_that_got_a_chunk_feed_the_tracker():
+    tracker = LatencyTracker()
+    await resilient_stream_text(ScriptedCalls(["plain"]), tracker=tracker, rng=rng())
+    assert len(tracker.samples) == 0
+
+    calls = ScriptedCalls([ConnectionError("reset by peer")], ["hedged"])
+    assert await resilient_stream_text(calls, hedge=True, tracker=tracker, rng=rng()) == "hedged"
+    # The failed first attempt is left out; the retry that answered is recorded
+    assert len(tracker.samples) == 1
+
+
+async def test_backoff_is_deterministic_with_a_seeded_rng():
+    first = [resilient_llm.backoff_delay(attempt, rng()) for attempt in range(5)]
+    second = [resilient_llm.backoff_delay(attempt, rng()) for attempt in range(5)]
+    assert first == second
+    assert all(0 <= delay <= min(resilient_llm.BACKOFF_CAP, resilient_llm.BACKOFF_BASE * 2 ** attempt)
+               for attempt, delay in enumerate(first))
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from main import ChatOrderedUpdateProcessor
+
+pytestmark = pytest.mark.asyncio
+
+SLOW = 0.3
+
+
+def update_for(chat_id, text="hello"):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=SimpleNamespace(text=text))
+
+
+async def timed(finished, name, seconds=0.0):
+    await asyncio.sleep(seconds)
+    finished[name] = asyncio.get_running_loop().time()
+
+
+async def test_queued_updates_of_one_chat_do_not_hold_slots():
+    processor = ChatOrderedUpdateProcessor(2)
+    loop = asyncio.get_running_loop()
+    finished = {}
+    started = loop.time()
+
+    a_slow = asyncio.create_task(processor.process_update(update_for(1), timed(finished, "a1", SLOW)))
+    a_queued = asyncio.create_task(processor.process_update(update_for(1), timed(finished, "a2")))
+    await asyncio.sleep(0)
+    b_instant = asyncio.create_task(processor.process_update(update_for(2), timed(finished, "b1")))
+    await asyncio.gather(a_slow, a_queued, b_instant)
+
+    assert finished["b1"] - started < SLOW / 3
+    assert finished["a1"] <= finished["a2"]
+    assert processor._chat_locks == {} and processor._chat_waiters == {}
+
+
+async def test_updates_of_one_chat_run_in_order():
+    processor = ChatOrderedUpdateProcessor(4)
+    order = []
+
+    async def record(name, seconds):
+        await asyncio.sleep(seconds)
+        order.append(name)
+
+    await asyncio.gather(*(
+        processor.process_update(update_for(1), record(name, seconds))
+        for name, seconds in (("first", 0.05), ("second", 0.0), ("third", 0.01))
+    ))
+    assert order == ["first", "second", "third"]
+
+
+async def test_cancel_skips_the_chat_queue():
+    processor = ChatOrderedUpdateProcessor(2)
+    finished = {}
+
+    slow = asyncio.create_task(processor.process_update(update_for(1), timed(finished, "slow", SLOW)))
+    await asyncio.sleep(0)
+    await processor.process_update(update_for(1, "/cancel"), timed(finished, "cancel"))
+    assert "slow" not in finished
+    await slow
+
+
+async def test_update_limit_is_enforced_across_chats():
+    processor = ChatOrderedUpdateProcessor(2)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    await asyncio.gather(*(processor.process_update(update_for(chat_id), work()) for chat_id in range(6)))
+    assert peak == 2
+
+
+async def test_limit_must_be_positive():
+    with pytest.raises(ValueError):
+        ChatOrderedUpdateProcessor(0)